@@ -2,96 +2,726 @@
 Handling the AI moves.
 Có sử dụng thuật toán Negamax và cắt tỉa Alpha-beta
 """
+import argparse
+import atexit
+import os
 import random
+import sys
+import time
+from multiprocessing import Lock, Pool, Value, shared_memory
+import ChessEngine
+import ChessBook
+import ChessBitbase
+import ChessPosition
+import ChessTime
+from ChessEngine import piece_score, piece_position_scores
 
-piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
-#Đánh giá mức độ quan trọng của từng quân cờ (VD: 0 là không thể để mất,Q là quan trọng nhất và chỉ mang tính tương đối)
-
-knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
-                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
-                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
-                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
-                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
-               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
-
-queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
-               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
-               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
-               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-piece_position_scores = {"wN": knight_scores,
-                         "bN": knight_scores[::-1],
-                         "wB": bishop_scores,
-                         "bB": bishop_scores[::-1],
-                         "wQ": queen_scores,
-                         "bQ": queen_scores[::-1],
-                         "wR": rook_scores,
-                         "bR": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1]}
+try:
+    import numpy as np
+except ImportError:  # numpy is only needed by the batch evaluator
+    np = None
 
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 3
+DEPTH = 3  # search depth when findBestMove gets no time budget
+MAX_DEPTH = 20  # iterative deepening limit with a time budget
+TIME_CHECK_NODES = 256  # the clock is checked once every this many nodes
+INTERRUPT_POLL_SECONDS = 0.01  # findBestMoveParallel polls its interrupt this often while the workers search
+DELTA_MARGIN = 2  # quiescence skips captures that can't raise the score to alpha even with this much extra
+USE_OPENING_BOOK = True
+OPENING_BOOK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "opening_book.bin")  # ChessBook.py
+USE_BITBASES = True  # exact KQK/KRK/KPK results when ChessBitbase.py has built the files
+BITBASE_WIN_SCORE = 100  # won bitbase positions score this plus material and progress, below CHECKMATE
+SEARCH_WORKERS = 1  # processes for the root search, findBestMove splits the root moves over them when > 1
 
+# Transposition table settings
+TT_SIZE_MB = 16
+TT_REPLACEMENT = "depth"  # "depth": keep the deeper entry, "always": newest entry wins
+TT_EXACT = 0
+TT_LOWER = 1  # score is a lower bound (search failed high)
+TT_UPPER = 2  # score is an upper bound (search failed low)
+SHARED_TT = True  # findBestMoveParallel workers share one SharedTranspositionTable instead of a table each
 
-def findBestMove(game_state, valid_moves, return_queue):
-    global next_move
-    next_move = None
+# Move ordering settings
+USE_MOVE_ORDERING = True
+USE_STAGED_MOVES = True  # below the root, generate hash move, captures, killers and quiet moves one stage at a time
+KILLER_SLOTS = 2
+MVV_LVA_VALUES = {"p": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}
+FIRST_MOVE_SCORE = 1 << 30  # hash/PV move
+CAPTURE_SCORE = 1 << 20  # captures and promotions before killers and quiet moves
+KILLER_SCORE = 1 << 19
+
+# Batch evaluation: plane/code order of the pieces, code 0 is an empty square in the (N, 64) format
+BATCH_PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+BATCH_PIECE_CODES = {piece: code for code, piece in enumerate(BATCH_PIECES, 1)}
+if np is not None:
+    # piece values and piece-square tables as arrays indexed by [plane] and [plane, square], black negative
+    PIECE_VALUE_ARRAY = np.array([piece_score[piece[1]] * (1 if piece[0] == "w" else -1) for piece in BATCH_PIECES],
+                                 dtype=np.float64)
+    POSITION_SCORE_ARRAY = np.array([np.ravel(piece_position_scores[piece]) * (1 if piece[0] == "w" else -1)
+                                     if piece in piece_position_scores else np.zeros(64) for piece in BATCH_PIECES],
+                                    dtype=np.float64)
+    # score of every (plane, square), and the same with an empty-square row 0 for the (N, 64) codes
+    BATCH_SCORE_TABLE = PIECE_VALUE_ARRAY[:, None] + POSITION_SCORE_ARRAY
+    BATCH_CODE_SCORE_TABLE = np.vstack((np.zeros((1, 64)), BATCH_SCORE_TABLE))
+    # piece code by the two ASCII characters of a board string such as "wN", "--" stays 0
+    BATCH_CODE_LOOKUP = np.zeros((128, 128), dtype=np.int8)
+    for _piece, _code in BATCH_PIECE_CODES.items():
+        BATCH_CODE_LOOKUP[ord(_piece[0]), ord(_piece[1])] = _code
+
+
+class TranspositionTable:
+    """
+    Fixed-size hash table of search results keyed by GameState.zobrist_key.
+    Each slot holds one (key, depth, score, bound, best move, age) tuple, the slot index is key & (size - 1).
+    """
+    ENTRY_BYTES = 160  # approximate memory of one stored tuple with its ints and float
+
+    def __init__(self, size_mb=TT_SIZE_MB, replacement=TT_REPLACEMENT):
+        if replacement not in ("depth", "always"):
+            raise ValueError("replacement must be 'depth' or 'always'")
+        count = 1
+        while count * 2 * self.ENTRY_BYTES <= size_mb * 1024 * 1024:
+            count *= 2
+        self.entries = [None] * count
+        self.mask = count - 1
+        self.replacement = replacement
+        self.age = 0  # bumped for every new search so entries from old searches get replaced first
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        self.entries = [None] * len(self.entries)
+        self.age = 0
+
+    def newSearch(self):
+        self.age += 1
+
+    def probe(self, key, board=None):
+        """
+        Return the (key, depth, score, bound, best move, age) entry stored for key, or None.
+        board is only needed by tables that store move codes.
+        """
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            self.hits += 1
+            return entry
+        return None
+
+    def store(self, key, depth, score, bound, best_move):
+        index = key & self.mask
+        if self.replacement == "depth":
+            entry = self.entries[index]
+            # keep a deeper result of the current search for another position
+            if entry is not None and entry[0] != key and entry[5] == self.age and entry[1] > depth:
+                return
+        self.entries[index] = (key, depth, score, bound, best_move, self.age)
+        self.stores += 1
+
+
+class SharedTranspositionTable:
+    """
+    Transposition table in a multiprocessing.shared_memory block, so several search processes fill and read one
+    table of fixed size. Create it in one process and open it in the others by name.
+    A slot is two 64-bit words, (key ^ data, data), where data packs the score, depth, bound, best move code and age.
+    Writes take no lock: a slot torn by two processes writing at once fails the XOR check and reads as empty.
+    Scores are stored to 1 / SCORE_SCALE of a pawn, best moves as Move.code and rebuilt on the board given to probe().
+    """
+    ENTRY_BYTES = 16
+    HEADER_WORDS = 2  # word 0 is the age, shared so every process stores with the same one
+    SCORE_SCALE = 10000
+    SCORE_BIAS = 1 << 31
+
+    def __init__(self, size_mb=TT_SIZE_MB, replacement=TT_REPLACEMENT, name=None):
+        if replacement not in ("depth", "always"):
+            raise ValueError("replacement must be 'depth' or 'always'")
+        if name is None:
+            count = 1
+            while count * 2 * self.ENTRY_BYTES <= size_mb * 1024 * 1024:
+                count *= 2
+            size = self.HEADER_WORDS * 8 + count * self.ENTRY_BYTES
+            self.memory = shared_memory.SharedMemory(create=True, size=size)
+        else:
+            self.memory = shared_memory.SharedMemory(name=name)
+            count = 1
+            while self.HEADER_WORDS * 8 + count * 2 * self.ENTRY_BYTES <= self.memory.size:
+                count *= 2
+        self.words = self.memory.buf.cast("Q")
+        self.mask = count - 1
+        self.replacement = replacement
+        self.hits = 0
+        self.stores = 0
+
+    @property
+    def name(self):
+        return self.memory.name
+
+    @property
+    def age(self):
+        return self.words[0]
+
+    def close(self):
+        """
+        Detach this process, the table lives on until unlink() and the last close().
+        """
+        self.words.release()
+        self.memory.close()
+
+    def unlink(self):
+        self.memory.unlink()
+
+    def clear(self):
+        self.memory.buf[:] = bytes(self.memory.size)
+
+    def newSearch(self):
+        self.words[0] += 1
+
+    def probe(self, key, board=None):
+        """
+        Return the (key, depth, score, bound, best move, age) entry stored for key, or None.
+        The best move is None without a board.
+        """
+        index = self.HEADER_WORDS + (key & self.mask) * 2
+        words = self.words
+        data = words[index + 1]
+        if words[index] ^ data != key:
+            return None
+        self.hits += 1
+        code = data & 0xFFFF
+        best_move = None
+        if code and board is not None:
+            start = code & 63
+            end = code >> 6 & 63
+            best_move = ChessEngine.cachedMove((start >> 3, start & 7), (end >> 3, end & 7), board,
+                                               bool(code >> 14 & 1), bool(code >> 15 & 1),
+                                               ChessEngine.Move.promotion_pieces[code >> 12 & 3])
+        return (key, data >> 16 & 255, ((data >> 32) - self.SCORE_BIAS) / self.SCORE_SCALE, data >> 24 & 3,
+                best_move, data >> 26 & 63)
+
+    def store(self, key, depth, score, bound, best_move):
+        index = self.HEADER_WORDS + (key & self.mask) * 2
+        words = self.words
+        age = words[0] & 63
+        if self.replacement == "depth":
+            data = words[index + 1]
+            # keep a deeper result of the current search for another position
+            if data and words[index] ^ data != key and data >> 26 & 63 == age and data >> 16 & 255 > depth:
+                return
+        data = (round(score * self.SCORE_SCALE) + self.SCORE_BIAS) << 32 | age << 26 | bound << 24 | depth << 16 | \
+            (0 if best_move is None else best_move.code)
+        words[index + 1] = data
+        words[index] = key ^ data
+        self.stores += 1
+
+
+class MoveOrdering:
+    """
+    Orders moves so alpha-beta cuts off early: hash/PV move, captures by MVV-LVA, killer moves, then quiet moves by history.
+    Killers are kept per ply, the butterfly history table is indexed by side to move and moveID.
+    """
+
+    def __init__(self, max_ply=MAX_DEPTH + 1):
+        self.killers = [[None] * KILLER_SLOTS for _ in range(max_ply)]
+        self.history = [[0] * 40000, [0] * 40000]  # [black, white][moveID], underpromotions have moveID up to 37777
+
+    def newSearch(self):
+        for killers in self.killers:
+            for slot in range(KILLER_SLOTS):
+                killers[slot] = None
+        for history in self.history:
+            history[:] = [value >> 1 for value in history]  # keep old history but let the new search outweigh it
+
+    @staticmethod
+    def captureScore(move):
+        """
+        MVV-LVA: most valuable victim first, least valuable attacker among equal victims.
+        """
+        score = 0
+        if move.is_capture:
+            score += MVV_LVA_VALUES[move.piece_captured[1]] * 16 - MVV_LVA_VALUES[move.piece_moved[1]]
+        if move.is_pawn_promotion:
+            score += MVV_LVA_VALUES[move.promotion_piece] * 16
+        return score
+
+    def orderMoves(self, moves, ply, white_to_move, first_moves=()):
+        """
+        Return moves sorted best first. first_moves (hash move, PV move) go in front in the given order.
+        """
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history[white_to_move]
+        first_ids = [move.moveID for move in first_moves if move is not None]
+
+        def moveScore(move):
+            if move.moveID in first_ids:
+                return FIRST_MOVE_SCORE - first_ids.index(move.moveID)
+            if move.is_capture or move.is_pawn_promotion:
+                return CAPTURE_SCORE + self.captureScore(move)
+            if move in killers:
+                return KILLER_SCORE - killers.index(move)
+            return history[move.moveID]
+
+        return sorted(moves, key=moveScore, reverse=True)
+
+    def stagedMoves(self, game_state, ply, first_moves=()):
+        """
+        Generator of the same order as orderMoves from GameState.generateStagedMoves, so a cutoff skips
+        generating the later stages. Quiet promotions come first among the quiet moves, after the killers.
+        """
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history[game_state.white_to_move]
+
+        def quietScore(move):
+            if move.is_pawn_promotion:
+                return CAPTURE_SCORE + self.captureScore(move)
+            return history[move.moveID]
+
+        return game_state.generateStagedMoves(first_moves, killers, self.captureScore, quietScore)
+
+    def addCutoff(self, move, ply, depth, white_to_move):
+        """
+        Remember a quiet move that caused a beta cutoff as a killer of this ply and in the history table.
+        """
+        if move.is_capture or move.is_pawn_promotion:
+            return
+        if ply < len(self.killers):
+            killers = self.killers[ply]
+            if killers[0] != move:
+                killers.pop()
+                killers.insert(0, move)
+        self.history[white_to_move][move.moveID] += depth * depth
+
+
+transposition_table = TranspositionTable()
+move_ordering = MoveOrdering()
+nodes_searched = 0
+search_depth = DEPTH  # depth of the current iterative deepening iteration
+search_deadline = float("inf")
+search_stopped = False
+search_interrupt = None  # callable polled with the clock, the search stops when it returns True
+principal_variation = []  # best line found by the last completed iteration
+search_score = None  # score of that iteration for the side to move, None for a move played without searching
+opening_book = None  # ChessBook.OpeningBook, opened by the first bookMove() call
+opening_book_missing = False
+search_pool = None  # Pool of findBestMoveParallel, started by the first parallel search and kept for the next ones
+search_pool_workers = 0
+search_pool_table = None  # its SharedTranspositionTable with SHARED_TT
+search_count = 0  # parallel searches started, tells the pool processes when the root position changed
+root_alpha = None  # best root score of the current iteration, shared with the pool processes
+root_alpha_lock = None
+root_cancelled = None  # set to 1 to stop the searches of the pool processes
+root_search = None  # in a pool process: number of the search root_game_state belongs to
+
+
+def findBestMove(game_state, valid_moves, return_queue, time_budget=None, interrupt=None, hard_limit=None):
+    """
+    Iterative deepening: search depth 1, 2, 3... until time_budget seconds run out, or up to DEPTH without a budget.
+    With hard_limit (the soft and hard limits of ChessTime.allocateTime) time_budget is the time to aim for: the
+    search stops sooner while the best move is stable and is only cut off at hard_limit, a single legal move is
+    played at once. interrupt, if given, is called every TIME_CHECK_NODES nodes and stops the search when it
+    returns True. Puts the best move of the last completed iteration on return_queue, its score in search_score,
+    or a book move without searching.
+    """
+    global principal_variation, search_score
+    search_score = None
+    book_move = bookMove(game_state, valid_moves)
+    if book_move is not None:
+        principal_variation = [book_move]
+        return_queue.put(book_move)
+        return
+    if hard_limit is not None and len(valid_moves) == 1:
+        principal_variation = [valid_moves[0]]
+        return_queue.put(valid_moves[0])
+        return
+    if SEARCH_WORKERS > 1:
+        return findBestMoveParallel(game_state, valid_moves, return_queue, time_budget, hard_limit=hard_limit,
+                                    interrupt=interrupt)
+    global next_move, nodes_searched, search_depth, search_deadline, search_stopped, search_interrupt
+    nodes_searched = 0
+    transposition_table.newSearch()
+    move_ordering.newSearch()
+    random.shuffle(valid_moves)  # equal moves keep a random order, sorting is stable
+    start_time = time.perf_counter()
+    if time_budget is None:
+        max_depth = DEPTH
+        search_deadline = float("inf")
+    else:
+        max_depth = MAX_DEPTH
+        search_deadline = start_time + (time_budget if hard_limit is None else hard_limit)
+    search_stopped = False
+    search_interrupt = interrupt
+    principal_variation = []
+    best_move = None
+    stable_iterations = 0  # completed iterations the best move has stayed the same
+    for depth in range(1, max_depth + 1):
+        search_depth = depth
+        next_move = None
+        score = findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, -CHECKMATE, CHECKMATE,
+                                         1 if game_state.white_to_move else -1)
+        if search_stopped:
+            break  # unfinished iteration, keep the move of the previous one
+        stable_iterations = stable_iterations + 1 if next_move == best_move else 0
+        best_move = next_move
+        search_score = score
+        principal_variation = getPrincipalVariation(game_state, depth)
+        if abs(score) >= CHECKMATE:
+            break  # forced mate found
+        if time_budget is not None and not ChessTime.startNextIteration(
+                time.perf_counter() - start_time, time_budget, None if hard_limit is None else stable_iterations):
+            break  # the next iteration would not finish in time
+    return_queue.put(best_move)
+
+
+def getPrincipalVariation(game_state, depth):
+    """
+    Follow the best moves stored in the transposition table from the current position.
+    """
+    line = []
+    for _ in range(depth):
+        entry = transposition_table.probe(game_state.zobrist_key, game_state.board)
+        if entry is None or entry[4] is None or entry[4] not in game_state.getValidMoves():
+            break
+        line.append(entry[4])
+        game_state.makeMove(entry[4])
+    for _ in line:
+        game_state.undoMove()
+    return line
+
+
+def bookMove(game_state, valid_moves):
+    """
+    Move from the opening book for the position, None when there is no book or the position isn't in it.
+    """
+    global opening_book, opening_book_missing
+    if not USE_OPENING_BOOK or opening_book_missing:
+        return None
+    if opening_book is None:
+        if not os.path.exists(OPENING_BOOK_FILE):
+            opening_book_missing = True
+            return None
+        opening_book = ChessBook.OpeningBook(OPENING_BOOK_FILE)
+    return opening_book.pickMove(game_state, valid_moves)
+
+
+def findBestMoveParallel(game_state, valid_moves, return_queue, time_budget=None, workers=None, depth=None,
+                         hard_limit=None, interrupt=None):
+    """
+    Iterative deepening with the root moves split over a pool of workers processes (default SEARCH_WORKERS).
+    Every iteration searches the first move alone to get a bound, then the rest in parallel against the best
+    score so far, shared between the workers. With SHARED_TT the workers fill one SharedTranspositionTable, so
+    they use each other's results and the table doesn't grow with the workers, otherwise each keeps its own.
+    The pool and the table are kept for the next search (getSearchPool), move ordering stays warm in each worker
+    across the iterations. Without a time budget it searches to depth (default DEPTH), time_budget, hard_limit
+    and interrupt are used as in findBestMove. interrupt is polled here, the workers stop on a shared flag.
+    """
+    global nodes_searched, principal_variation, search_score, search_count, search_depth, search_stopped
+    workers = workers or SEARCH_WORKERS
+    start_time = time.perf_counter()
+    if time_budget is None:
+        max_depth = depth or DEPTH
+        deadline = float("inf")
+    else:
+        max_depth = MAX_DEPTH
+        # wall clock, the workers have their own perf_counter
+        deadline = time.time() + (time_budget if hard_limit is None else hard_limit)
     random.shuffle(valid_moves)
-    findMoveNegaMaxAlphaBeta(game_state, valid_moves, DEPTH, -CHECKMATE, CHECKMATE,
-                             1 if game_state.white_to_move else -1)
-    return_queue.put(next_move)
+    nodes_searched = 0
+    principal_variation = []
+    search_score = None
+    best_move = None
+    stable_iterations = 0
+    codes = [move.code for move in valid_moves]
+    root_scores = {}
+    search_count += 1
+    pool = getSearchPool(workers)
+    root_cancelled.value = 0
+    search_stopped = False
+    if search_pool_table is not None:
+        search_pool_table.newSearch()
+    # the workers get the position as a ChessPosition record, not the pickled GameState with its whole history
+    position = (search_count, ChessPosition.encodePosition(game_state), type(game_state), game_state.underpromotions)
+    for iteration_depth in range(1, max_depth + 1):
+        # best move of the previous iteration first, then by its score
+        codes.sort(key=lambda code: -root_scores.get(code, -CHECKMATE))
+        search_depth = iteration_depth
+        root_alpha.value = -CHECKMATE
+        jobs = [(position, code, iteration_depth, deadline, principal_variation) for code in codes]
+        iteration_interrupt = interrupt if iteration_depth > 1 else None  # as in findBestMove, depth 1 always ends
+        results = [_waitForJobs(pool.apply_async(_searchRootMove, (jobs[0],)), iteration_interrupt)]
+        results += _waitForJobs(pool.map_async(_searchRootMove, jobs[1:], chunksize=1), iteration_interrupt)
+        nodes_searched += sum(result[2] for result in results)
+        if any(result[1] is None for result in results):
+            search_stopped = True
+            break  # unfinished iteration, keep the move of the previous one
+        root_scores = {code: score for code, score, _, _ in results}
+        best_code, score, _, line = max(results, key=lambda result: (result[1], -codes.index(result[0])))
+        stable_iterations = stable_iterations + 1 if best_move is not None and best_code == best_move.code else 0
+        best_move = valid_moves[[move.code for move in valid_moves].index(best_code)]
+        principal_variation = [best_move] + line
+        search_score = score
+        if abs(score) >= CHECKMATE:
+            break  # forced mate found
+        if time_budget is not None and not ChessTime.startNextIteration(
+                time.perf_counter() - start_time, time_budget, None if hard_limit is None else stable_iterations):
+            break  # the next iteration would not finish in time
+    return_queue.put(best_move)
+
+
+def _waitForJobs(result, interrupt):
+    """
+    Wait for the AsyncResult of pool jobs and return its value, telling the workers to stop once interrupt returns
+    True. The stopped jobs still answer, with a score of None.
+    """
+    if interrupt is not None:
+        while not result.ready():
+            result.wait(INTERRUPT_POLL_SECONDS)
+            if not root_cancelled.value and interrupt():
+                root_cancelled.value = 1
+    return result.get()
+
+
+def getSearchPool(workers):
+    """
+    The Pool of findBestMoveParallel with workers processes and, with SHARED_TT, the table they share. Both are
+    made on first use and kept for the next searches, a different worker count or SHARED_TT setting replaces them.
+    """
+    global search_pool, search_pool_workers, search_pool_table, root_alpha, root_alpha_lock, root_cancelled
+    if search_pool is not None and search_pool_workers == workers and (search_pool_table is not None) == SHARED_TT:
+        return search_pool
+    closeSearchPool()
+    root_alpha = Value("d", -CHECKMATE, lock=False)
+    root_alpha_lock = Lock()
+    root_cancelled = Value("b", 0, lock=False)
+    search_pool_table = SharedTranspositionTable() if SHARED_TT else None
+    table_name = None if search_pool_table is None else search_pool_table.name
+    search_pool = Pool(workers, initializer=_initRootWorker,
+                       initargs=(root_alpha, root_alpha_lock, root_cancelled, table_name))
+    search_pool_workers = workers
+    return search_pool
+
+
+def closeSearchPool():
+    """
+    Stop the pool of findBestMoveParallel and free its shared table, if they were made. Runs at exit.
+    """
+    global search_pool, search_pool_table
+    if search_pool is not None:
+        search_pool.terminate()
+        search_pool.join()
+        search_pool = None
+    if search_pool_table is not None:
+        search_pool_table.close()
+        search_pool_table.unlink()
+        search_pool_table = None
+
+
+atexit.register(closeSearchPool)
+
+
+def _initRootWorker(shared_alpha, alpha_lock, cancelled, table_name):
+    global root_alpha, root_alpha_lock, root_cancelled, search_interrupt, transposition_table
+    root_alpha = shared_alpha
+    root_alpha_lock = alpha_lock
+    root_cancelled = cancelled
+    search_interrupt = _rootSearchCancelled
+    if table_name is not None:
+        transposition_table = SharedTranspositionTable(name=table_name)
+
+
+def _rootSearchCancelled():
+    return root_cancelled.value != 0
+
+
+def _setRootPosition(position):
+    """
+    Set root_game_state up in a worker from the position of a job, when the job starts a new search.
+    """
+    global root_game_state, root_search
+    search, record, game_state_class, underpromotions = position
+    if search == root_search:
+        return
+    root_game_state = ChessPosition.decodePosition(record, game_state_class())
+    root_game_state.underpromotions = underpromotions
+    root_search = search
+    if not isinstance(transposition_table, SharedTranspositionTable):
+        transposition_table.newSearch()
+    move_ordering.newSearch()
+
+
+def _searchRootMove(job):
+    """
+    Search one root move in a worker, return (move code, score or None if stopped, nodes, rest of its line).
+    """
+    global nodes_searched, search_depth, search_deadline, search_stopped, principal_variation
+    position, code, depth, deadline, principal_variation = job
+    if root_cancelled.value or depth > 1 and time.time() >= deadline:
+        return code, None, 0, []  # stopped before it started, as searchShouldStop would stop it
+    _setRootPosition(position)
+    game_state = root_game_state
+    nodes_searched = 0
+    search_depth = depth
+    search_deadline = time.perf_counter() + (deadline - time.time())
+    search_stopped = False
+    turn_multiplier = 1 if game_state.white_to_move else -1
+    move = ChessEngine.Move.fromCode(code, game_state.board)
+    game_state.makeMove(move)
+    score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -CHECKMATE, -root_alpha.value,
+                                      -turn_multiplier)
+    line = [] if search_stopped else getPrincipalVariation(game_state, depth - 1)
+    game_state.undoMove()
+    if search_stopped:
+        return code, None, nodes_searched, line
+    with root_alpha_lock:
+        if score > root_alpha.value:
+            root_alpha.value = score
+    return code, score, nodes_searched, line
+
+
+def searchShouldStop():
+    """
+    True when the deadline has passed or search_interrupt asks the search to stop.
+    """
+    return time.perf_counter() >= search_deadline or (search_interrupt is not None and search_interrupt())
 
 
 def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier):
-    global next_move
+    """
+    Negamax with alpha-beta pruning. valid_moves may be None, the moves are then only generated
+    when the transposition table can't answer for this position.
+    """
+    global next_move, nodes_searched, search_stopped
+    nodes_searched += 1
+    if nodes_searched % TIME_CHECK_NODES == 0 and search_depth > 1 and searchShouldStop():
+        search_stopped = True  # depth 1 always finishes so there is a move to play
+    if search_stopped:
+        return 0
+
+    # transposition table: cut off with a deep enough stored score, otherwise search the stored best move first
+    key = game_state.zobrist_key
+    alpha_original = alpha
+    hash_move = None
+    entry = transposition_table.probe(key, game_state.board)
+    if entry is not None:
+        if entry[1] >= depth and depth != search_depth:  # the root still has to pick next_move
+            if entry[3] == TT_EXACT:
+                return entry[2]
+            elif entry[3] == TT_LOWER:
+                alpha = max(alpha, entry[2])
+            else:
+                beta = min(beta, entry[2])
+            if alpha >= beta:
+                return entry[2]
+        hash_move = entry[4]
+
+    # bitbase draws are exact, there is nothing to search for
+    if USE_BITBASES and depth != search_depth and game_state.pieceCount() == 3:
+        result = ChessBitbase.probe(game_state)
+        if result is not None and result[0] == 0:
+            return 0
+
     if depth == 0:
-        return turn_multiplier * scoreBoard(game_state)
-     # move ordering - implement later //TODO
+        score = quiescenceSearch(game_state, alpha, beta, turn_multiplier)
+        if search_stopped:
+            return 0
+        if score <= alpha:  # the window may already be narrowed by the table entry
+            bound = TT_UPPER
+        elif score >= beta:
+            bound = TT_LOWER
+        else:
+            bound = TT_EXACT
+        transposition_table.store(key, 0, score, bound, None)
+        return score
+    # the move of the previous iteration's principal variation goes first, then the hash move
+    ply = search_depth - depth
+    pv_move = None
+    if ply < len(principal_variation) and \
+            game_state.move_log[len(game_state.move_log) - ply:] == principal_variation[:ply]:
+        pv_move = principal_variation[ply]
+    if valid_moves is None and USE_MOVE_ORDERING and USE_STAGED_MOVES:
+        valid_moves = move_ordering.stagedMoves(game_state, ply, (pv_move, hash_move))
+    else:
+        if valid_moves is None:
+            valid_moves = game_state.getValidMoves()  # also sets the checkmate and stalemate flags
+        if USE_MOVE_ORDERING:
+            valid_moves = move_ordering.orderMoves(valid_moves, ply, game_state.white_to_move,
+                                                   (pv_move, hash_move))
+        else:
+            for first_move in (hash_move, pv_move):
+                if first_move is not None and first_move in valid_moves:
+                    valid_moves = [first_move] + [move for move in valid_moves if move != first_move]
     max_score = -CHECKMATE
+    best_move = None
     for move in valid_moves:
         game_state.makeMove(move)
-        next_moves = game_state.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(game_state, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
+        score = -findMoveNegaMaxAlphaBeta(game_state, None, depth - 1, -beta, -alpha, -turn_multiplier)
+        game_state.undoMove()
+        if search_stopped:
+            return 0
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            best_move = move
+            if depth == search_depth:
                 next_move = move
+        if max_score > alpha:
+            alpha = max_score
+        if alpha >= beta:
+            if USE_MOVE_ORDERING:
+                move_ordering.addCutoff(move, ply, depth, game_state.white_to_move)
+            break
+
+    if max_score <= alpha_original:
+        bound = TT_UPPER
+    elif max_score >= beta:
+        bound = TT_LOWER
+    else:
+        bound = TT_EXACT
+    transposition_table.store(key, depth, max_score, bound, best_move)
+    return max_score
+
+
+def quiescenceSearch(game_state, alpha, beta, turn_multiplier):
+    """
+    Search captures only until the position is quiet, so the depth limit doesn't stop in the middle of an exchange.
+    The side to move may stand pat on the static score unless it is in check or stalemated.
+    """
+    global nodes_searched, search_stopped
+    nodes_searched += 1
+    if nodes_searched % TIME_CHECK_NODES == 0 and search_depth > 1 and searchShouldStop():
+        search_stopped = True
+    if search_stopped:
+        return 0
+
+    captures = game_state.getValidCaptures()  # all evasions when in check, also sets the checkmate flag
+    in_check = game_state.in_check
+    if in_check:
+        if game_state.checkmate:
+            return -CHECKMATE
+        max_score = -CHECKMATE
+    else:
+        if not captures and not game_state.getValidQuiets():
+            return STALEMATE  # standing pat would score the material of a side that can't move
+        stand_pat = turn_multiplier * scoreBoard(game_state)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        max_score = stand_pat
+
+    captures.sort(key=MoveOrdering.captureScore, reverse=True)
+    for move in captures:
+        if not in_check:
+            # delta pruning: even winning the captured piece for free doesn't reach alpha
+            gain = piece_score[move.piece_captured[1]] if move.is_capture else 0
+            if move.is_pawn_promotion:
+                gain += piece_score[move.promotion_piece] - piece_score["p"]
+            if stand_pat + gain + DELTA_MARGIN <= alpha:
+                continue
+        game_state.makeMove(move)
+        score = -quiescenceSearch(game_state, -beta, -alpha, -turn_multiplier)
         game_state.undoMove()
+        if search_stopped:
+            return 0
+        if score > max_score:
+            max_score = score
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
@@ -102,6 +732,47 @@ def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_m
 def scoreBoard(game_state):
     """
     Score the board. A positive score is good for white, a negative score is good for black.
+    Material and piece positions come from the incrementally updated game_state.eval_score.
+    """
+    if game_state.checkmate:
+        if game_state.white_to_move:
+            return -CHECKMATE  # black wins
+        else:
+            return CHECKMATE  # white wins
+    elif game_state.stalemate:
+        return STALEMATE #Hòa
+    if USE_BITBASES and game_state.pieceCount() == 3:
+        score = bitbaseScore(game_state)
+        if score is not None:
+            return score
+    return game_state.eval_score / 100
+
+
+def bitbaseScore(game_state):
+    """
+    Exact result of a KQK, KRK or KPK position, None without a bitbase. Wins add progress terms so the search
+    drives the lone king to the edge with its own king close, or pushes the pawn.
+    """
+    result = ChessBitbase.probe(game_state)
+    if result is None:
+        return None
+    winner, material, strong_king, weak_king, piece_square = result
+    if winner == 0:
+        return STALEMATE
+    piece = ChessBitbase.BITBASE_PIECES[material]
+    score = BITBASE_WIN_SCORE + piece_score[piece]
+    if piece == "p":
+        score += (6 - (piece_square >> 3)) * 0.5  # rows left to promotion
+    else:
+        weak_row, weak_col = weak_king >> 3, weak_king & 7
+        score += (max(3 - weak_row, weak_row - 4) + max(3 - weak_col, weak_col - 4)) * 0.5
+        score -= max(abs((strong_king >> 3) - weak_row), abs((strong_king & 7) - weak_col)) * 0.2
+    return winner * score
+
+
+def scoreBoardFullScan(game_state):
+    """
+    Score the board by walking all 64 squares, the reference for the incremental evaluation.
     """
     if game_state.checkmate:
         if game_state.white_to_move:
@@ -127,8 +798,154 @@ def scoreBoard(game_state):
     return score
 
 
+def checkEvaluationParity(games=100, max_moves=200, game_state_class=ChessEngine.GameState, seed=0):
+    """
+    Play random games and compare scoreBoard with scoreBoardFullScan after every move and undo.
+    Raises RuntimeError on the first difference, returns the number of positions compared.
+    """
+    rng = random.Random(seed)
+    positions = 0
+    for _ in range(games):
+        game_state = game_state_class()
+        for _ in range(max_moves):
+            valid_moves = game_state.getValidMoves()
+            if len(valid_moves) == 0:
+                break
+            move = rng.choice(valid_moves)
+            # after the move and after taking it back again
+            for step in (game_state.makeMove, lambda move: game_state.undoMove(), game_state.makeMove):
+                step(move)
+                game_state.getValidMoves()  # sets the checkmate and stalemate flags
+                fast = scoreBoard(game_state)
+                full = scoreBoardFullScan(game_state)
+                positions += 1
+                if abs(fast - full) > 1e-9:
+                    raise RuntimeError("scoreBoard " + str(fast) + " != full scan " + str(full) + " after " +
+                                       " ".join(str(m) for m in game_state.move_log))
+    return positions
+
+
+def boardsToBatch(boards, planes=False):
+    """
+    Encode GameState.board lists as an (N, 64) int8 array of BATCH_PIECE_CODES (0 = empty),
+    or with planes=True as (N, 12, 64) int8 one-hot planes in BATCH_PIECES order.
+    """
+    if np is None:
+        raise ImportError("boardsToBatch needs numpy")
+    # join every board into one ASCII string of 2-character squares and look the codes up in one go
+    text = "".join(["".join(map("".join, board)) for board in boards])
+    characters = np.frombuffer(text.encode("ascii"), dtype=np.uint8).reshape(-1, 64, 2)
+    codes = BATCH_CODE_LOOKUP[characters[:, :, 0], characters[:, :, 1]]
+    if not planes:
+        return codes
+    return (codes[:, None, :] == np.arange(1, 13, dtype=np.int8)[None, :, None]).astype(np.int8)
+
+
+def scoreBoardBatch(batch):
+    """
+    Material + piece-square scores of N positions from an (N, 64) or (N, 12, 64) array made by boardsToBatch.
+    Same scale as scoreBoard, positive is good for white. Checkmate and stalemate are not detected.
+    """
+    if np is None:
+        raise ImportError("scoreBoardBatch needs numpy")
+    batch = np.asarray(batch)
+    if batch.ndim == 2 and batch.shape[1] == 64:
+        return BATCH_CODE_SCORE_TABLE[batch, np.arange(64)].sum(axis=1)
+    if batch.ndim == 3 and batch.shape[1:] == (12, 64):
+        return np.tensordot(batch.astype(np.float64), BATCH_SCORE_TABLE, axes=([1, 2], [0, 1]))
+    raise ValueError("batch must have shape (N, 64) or (N, 12, 64), got " + str(batch.shape))
+
+
+def benchmarkBatchEvaluation(count=20000, seed=0):
+    """
+    Score count positions from random games with scoreBoardFullScan in a loop and with scoreBoardBatch,
+    check that the scores agree and return the timings in seconds.
+    """
+    rng = random.Random(seed)
+    boards = []
+    game_state = ChessEngine.GameState()
+    while len(boards) < count:
+        valid_moves = game_state.getValidMoves()
+        if len(valid_moves) == 0 or len(game_state.move_log) >= 200:
+            game_state = ChessEngine.GameState()
+            continue
+        game_state.makeMove(rng.choice(valid_moves))
+        boards.append([row[:] for row in game_state.board])
+    game_state.checkmate = game_state.stalemate = False
+
+    start = time.perf_counter()
+    scalar_scores = []
+    for board in boards:
+        game_state.board = board
+        scalar_scores.append(scoreBoardFullScan(game_state))
+    scalar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    codes = boardsToBatch(boards)
+    convert_time = time.perf_counter() - start
+    start = time.perf_counter()
+    code_scores = scoreBoardBatch(codes)
+    codes_time = time.perf_counter() - start
+    planes = boardsToBatch(boards, planes=True)
+    start = time.perf_counter()
+    plane_scores = scoreBoardBatch(planes)
+    planes_time = time.perf_counter() - start
+
+    if not (np.allclose(code_scores, scalar_scores) and np.allclose(plane_scores, scalar_scores)):
+        raise RuntimeError("batch scores differ from scoreBoardFullScan")
+    return {"positions": count, "scalar": scalar_time, "convert": convert_time,
+            "batch_codes": codes_time, "batch_planes": planes_time}
+
+
+SEARCH_BENCHMARK_FENS = (
+    ChessEngine.START_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+    "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+)
+
+
+def benchmarkParallelSearch(worker_counts=(1, 2, 4, 8), depth=4, fens=SEARCH_BENCHMARK_FENS):
+    """
+    Time findBestMoveParallel to a fixed depth over the fens with each worker count,
+    return {workers: (seconds, nodes, speed-up over the first count)}.
+    """
+    import queue
+    results = {}
+    for workers in worker_counts:
+        seconds = 0.0
+        nodes = 0
+        for fen in fens:
+            game_state = ChessEngine.GameState()
+            game_state.loadFEN(fen)
+            random.seed(0)
+            start = time.perf_counter()
+            findBestMoveParallel(game_state, game_state.getValidMoves(), queue.Queue(), workers=workers, depth=depth)
+            seconds += time.perf_counter() - start
+            nodes += nodes_searched
+        baseline = results[worker_counts[0]][0] if results else seconds
+        results[workers] = (seconds, nodes, baseline / seconds)
+    return results
+
+
 def findRandomMove(valid_moves):
     """
     Picks and returns a random valid move.
     """
     return random.choice(valid_moves)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the parallel root search.")
+    parser.add_argument("-w", "--workers", type=int, nargs="+", default=[1, 2, 4, 8], help="worker counts to time")
+    parser.add_argument("-d", "--depth", type=int, default=4)
+    args = parser.parse_args(argv)
+    results = benchmarkParallelSearch(args.workers, args.depth)
+    for workers, (seconds, nodes, speed_up) in results.items():
+        print("%d workers: %.2fs  %d nodes  %.2fx" % (workers, seconds, nodes, speed_up))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
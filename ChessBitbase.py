@@ -0,0 +1,323 @@
+"""
+Endgame bitbases for king and queen, rook or pawn against a lone king, built by retrograde analysis.
+One bit per position says whether the side with the piece wins, the files are memory-mapped and probed in O(1).
+
+python ChessBitbase.py              build KQK, KRK and KPK into BITBASE_DIR
+
+Positions are stored with the strong side as white, white pawns moving towards row 0, and indexed
+side to move << 18 | strong king << 12 | weak king << 6 | piece, squares are row * 8 + col.
+"""
+import argparse
+import mmap
+import os
+import sys
+import time
+
+from ChessEngine import KING_SQUARES, ORTHOGONAL_RAYS, DIAGONAL_RAYS
+
+BITBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bitbases")
+BITBASE_MAGIC = b"CHSBB001"
+BITBASE_PIECES = {"KQK": "Q", "KRK": "R", "KPK": "p"}  # KPK promotes into the first two, so they are built first
+BITBASE_MATERIALS = {piece: material for material, piece in BITBASE_PIECES.items()}
+BITBASE_POSITIONS = 2 << 18
+STRONG_TO_MOVE = 0
+WEAK_TO_MOVE = 1
+
+KING_TARGETS = [[row * 8 + col for row, col in squares] for squares in KING_SQUARES]
+PIECE_RAYS = {
+    "R": [[[row * 8 + col for row, col in ray] for ray in ORTHOGONAL_RAYS[square]] for square in range(64)],
+    "Q": [[[row * 8 + col for row, col in ray] for ray in ORTHOGONAL_RAYS[square] + DIAGONAL_RAYS[square]]
+          for square in range(64)],
+}
+# BETWEEN[piece][from][to]: squares strictly between when the piece attacks along a line on an empty board
+BETWEEN = {piece: [{} for _ in range(64)] for piece in ("R", "Q")}
+for _piece in ("R", "Q"):
+    for _square in range(64):
+        for _ray in PIECE_RAYS[_piece][_square]:
+            for _index, _target in enumerate(_ray):
+                BETWEEN[_piece][_square][_target] = frozenset(_ray[:_index])
+
+
+def positionIndex(side_to_move, strong_king, weak_king, piece):
+    return side_to_move << 18 | strong_king << 12 | weak_king << 6 | piece
+
+
+def _kingsTouch(square, other):
+    return abs((square >> 3) - (other >> 3)) <= 1 and abs((square & 7) - (other & 7)) <= 1
+
+
+def _pieceAttacks(piece, piece_square, target, blocker):
+    """
+    True if the piece on piece_square attacks target, with blocker the only other piece that can be in the way.
+    """
+    if piece == "p":
+        return piece_square >> 3 != 0 and target >> 3 == (piece_square >> 3) - 1 and \
+            abs((target & 7) - (piece_square & 7)) == 1
+    between = BETWEEN[piece][piece_square].get(target)
+    return between is not None and blocker not in between
+
+
+def _isLegal(side_to_move, strong_king, weak_king, piece, piece_square):
+    if strong_king == weak_king or piece_square in (strong_king, weak_king) or _kingsTouch(strong_king, weak_king):
+        return False
+    if piece == "p" and piece_square >> 3 in (0, 7):
+        return False
+    # the weak king can't be in check with the strong side to move
+    return side_to_move == WEAK_TO_MOVE or not _pieceAttacks(piece, piece_square, weak_king, strong_king)
+
+
+def _strongMoves(piece, strong_king, weak_king, piece_square):
+    """
+    Positions (weak side to move) reached by the strong side's non-promoting moves.
+    """
+    for target in KING_TARGETS[strong_king]:
+        if target != piece_square and not _kingsTouch(target, weak_king):
+            yield target, piece_square
+    if piece == "p":
+        step = piece_square - 8
+        if step >> 3 != 0 and step not in (strong_king, weak_king):
+            yield strong_king, step
+            if piece_square >> 3 == 6 and step - 8 not in (strong_king, weak_king):
+                yield strong_king, step - 8
+    else:
+        for ray in PIECE_RAYS[piece][piece_square]:
+            for target in ray:
+                if target == strong_king or target == weak_king:
+                    break
+                yield strong_king, target
+
+
+def _strongUnmoves(piece, strong_king, weak_king, piece_square):
+    """
+    Positions (strong side to move) the strong side can have moved from, promotions excluded.
+    """
+    for target in KING_TARGETS[strong_king]:
+        if target != piece_square and target != weak_king:
+            yield target, piece_square
+    if piece == "p":
+        back = piece_square + 8
+        if back >> 3 <= 6 and back not in (strong_king, weak_king):
+            yield strong_king, back
+            if piece_square >> 3 == 4 and back + 8 not in (strong_king, weak_king):
+                yield strong_king, back + 8
+    else:
+        for ray in PIECE_RAYS[piece][piece_square]:
+            for target in ray:
+                if target == strong_king or target == weak_king:
+                    break
+                yield strong_king, target
+
+
+def generateBitbase(material, promotions=None):
+    """
+    Retrograde analysis of KQK, KRK or KPK. Returns a bytearray with 1 for every position the strong side wins.
+    promotions maps "Q" and "R" to the KQK and KRK tables, needed for KPK.
+    """
+    piece = BITBASE_PIECES[material]
+    win = bytearray(BITBASE_POSITIONS)
+    legal = bytearray(BITBASE_POSITIONS)
+    remaining = [0] * (BITBASE_POSITIONS >> 1)  # weak side to move: moves not yet known to lose
+    queue = []
+    for strong_king in range(64):
+        for weak_king in range(64):
+            for piece_square in range(64):
+                for side_to_move in (STRONG_TO_MOVE, WEAK_TO_MOVE):
+                    if _isLegal(side_to_move, strong_king, weak_king, piece, piece_square):
+                        legal[positionIndex(side_to_move, strong_king, weak_king, piece_square)] = 1
+    for strong_king in range(64):
+        for weak_king in range(64):
+            for piece_square in range(64):
+                index = positionIndex(WEAK_TO_MOVE, strong_king, weak_king, piece_square)
+                if legal[index]:
+                    moves = 0
+                    escapes = 0  # taking the piece draws
+                    for target in KING_TARGETS[weak_king]:
+                        if _kingsTouch(target, strong_king):
+                            continue
+                        if target == piece_square:
+                            escapes += 1
+                        elif not _pieceAttacks(piece, piece_square, target, strong_king):
+                            moves += 1
+                    if moves + escapes == 0:
+                        if _pieceAttacks(piece, piece_square, weak_king, strong_king):
+                            win[index] = 1  # checkmate
+                            queue.append(index)
+                        else:
+                            escapes = 1  # stalemate
+                    remaining[index & 0x3FFFF] = moves + (BITBASE_POSITIONS if escapes else 0)
+                index = positionIndex(STRONG_TO_MOVE, strong_king, weak_king, piece_square)
+                if legal[index] and piece == "p" and piece_square >> 3 == 1:
+                    target = piece_square - 8
+                    if target not in (strong_king, weak_king) and any(
+                            promotions[promoted][positionIndex(WEAK_TO_MOVE, strong_king, weak_king, target)]
+                            for promoted in ("Q", "R")):
+                        win[index] = 1
+                        queue.append(index)
+
+    while queue:
+        index = queue.pop()
+        strong_king = index >> 12 & 63
+        weak_king = index >> 6 & 63
+        piece_square = index & 63
+        if index >> 18 == WEAK_TO_MOVE:
+            # every strong move into a won position wins
+            for king, square in _strongUnmoves(piece, strong_king, weak_king, piece_square):
+                previous = positionIndex(STRONG_TO_MOVE, king, weak_king, square)
+                if legal[previous] and not win[previous]:
+                    win[previous] = 1
+                    queue.append(previous)
+        else:
+            # a weak position loses once all its moves lose
+            for king in KING_TARGETS[weak_king]:
+                previous = positionIndex(WEAK_TO_MOVE, strong_king, king, piece_square)
+                if legal[previous] and not win[previous]:
+                    remaining[previous & 0x3FFFF] -= 1
+                    if remaining[previous & 0x3FFFF] == 0:
+                        win[previous] = 1
+                        queue.append(previous)
+    return win
+
+
+def checkBitbase(material, win, promotions=None):
+    """
+    Check that every legal position agrees with its successors, raises RuntimeError on the first that doesn't.
+    """
+    piece = BITBASE_PIECES[material]
+    for strong_king in range(64):
+        for weak_king in range(64):
+            for piece_square in range(64):
+                index = positionIndex(STRONG_TO_MOVE, strong_king, weak_king, piece_square)
+                if _isLegal(STRONG_TO_MOVE, strong_king, weak_king, piece, piece_square):
+                    expected = any(win[positionIndex(WEAK_TO_MOVE, king, weak_king, square)]
+                                   for king, square in _strongMoves(piece, strong_king, weak_king, piece_square))
+                    target = piece_square - 8
+                    if piece == "p" and piece_square >> 3 == 1 and target not in (strong_king, weak_king):
+                        expected = expected or any(
+                            promotions[promoted][positionIndex(WEAK_TO_MOVE, strong_king, weak_king, target)]
+                            for promoted in ("Q", "R"))
+                    if win[index] != expected:
+                        raise RuntimeError(material + " mismatch at strong to move index " + str(index))
+                index = positionIndex(WEAK_TO_MOVE, strong_king, weak_king, piece_square)
+                if _isLegal(WEAK_TO_MOVE, strong_king, weak_king, piece, piece_square):
+                    targets = [target for target in KING_TARGETS[weak_king] if not _kingsTouch(target, strong_king)
+                               and (target == piece_square or
+                                    not _pieceAttacks(piece, piece_square, target, strong_king))]
+                    if targets:
+                        expected = all(target != piece_square and
+                                       win[positionIndex(STRONG_TO_MOVE, strong_king, target, piece_square)]
+                                       for target in targets)
+                    else:
+                        expected = _pieceAttacks(piece, piece_square, weak_king, strong_king)
+                    if win[index] != expected:
+                        raise RuntimeError(material + " mismatch at weak to move index " + str(index))
+    return True
+
+
+def packBits(win):
+    packed = bytearray(len(win) >> 3)
+    for index in range(len(win)):
+        if win[index]:
+            packed[index >> 3] |= 1 << (index & 7)
+    return packed
+
+
+def buildBitbases(directory=BITBASE_DIR, check=False):
+    """
+    Generate every bitbase into directory, return {material: (won positions, seconds)}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    tables = {}
+    stats = {}
+    for material in BITBASE_PIECES:
+        start = time.perf_counter()
+        promotions = {"Q": tables.get("KQK"), "R": tables.get("KRK")}
+        win = generateBitbase(material, promotions)
+        if check:
+            checkBitbase(material, win, promotions)
+        tables[material] = win
+        with open(os.path.join(directory, material + ".bin"), "wb") as bitbase_file:
+            bitbase_file.write(BITBASE_MAGIC)
+            bitbase_file.write(packBits(win))
+        stats[material] = (sum(win), time.perf_counter() - start)
+    return stats
+
+
+class Bitbase:
+    """
+    Memory-mapped bitbase file of one material.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(BITBASE_MAGIC)] != BITBASE_MAGIC or \
+                len(self.data) != len(BITBASE_MAGIC) + (BITBASE_POSITIONS >> 3):
+            self.close()
+            raise ValueError(path + " is not a bitbase")
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def isWin(self, index):
+        return self.data[len(BITBASE_MAGIC) + (index >> 3)] >> (index & 7) & 1 == 1
+
+
+bitbases = {}  # material: Bitbase, or None when the file is missing
+
+
+def loadBitbase(material, directory=None):
+    if material not in bitbases:
+        path = os.path.join(directory or BITBASE_DIR, material + ".bin")
+        bitbases[material] = Bitbase(path) if os.path.exists(path) else None
+    return bitbases[material]
+
+
+def probe(game_state):
+    """
+    Look up a position with two kings and one queen, rook or pawn. Returns None when it isn't covered, else
+    (winner, material, strong king, weak king, piece square) with winner 1 if white wins, -1 if black wins,
+    0 for a draw and the squares seen from the strong side (its pawn moving towards row 0).
+    """
+    pieces = [(game_state.board[square >> 3][square & 7], square) for square in game_state.occupiedSquares()]
+    if len(pieces) != 3:
+        return None
+    material = None
+    for piece, square in pieces:
+        if piece[1] != "K":
+            strong = piece[0]
+            material = BITBASE_MATERIALS.get(piece[1])
+            piece_square = square
+    if material is None:
+        return None
+    bitbase = loadBitbase(material)
+    if bitbase is None:
+        return None
+    for piece, square in pieces:
+        if piece[1] == "K":
+            if piece[0] == strong:
+                strong_king = square
+            else:
+                weak_king = square
+    side_to_move = STRONG_TO_MOVE if game_state.white_to_move == (strong == "w") else WEAK_TO_MOVE
+    if strong == "b":  # mirror the rows so the strong side plays up the board
+        strong_king ^= 56
+        weak_king ^= 56
+        piece_square ^= 56
+    if not bitbase.isWin(positionIndex(side_to_move, strong_king, weak_king, piece_square)):
+        return 0, material, strong_king, weak_king, piece_square
+    return (1 if strong == "w" else -1), material, strong_king, weak_king, piece_square
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the KQK, KRK and KPK bitbases.")
+    parser.add_argument("-o", "--output", default=BITBASE_DIR, help="directory for the .bin files")
+    parser.add_argument("--check", action="store_true", help="verify every position against its successors")
+    args = parser.parse_args(argv)
+    for material, (wins, seconds) in buildBitbases(args.output, args.check).items():
+        print("%s: %d won positions, %.1fs" % (material, wins, seconds))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
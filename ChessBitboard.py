@@ -0,0 +1,687 @@
+"""
+Bitboard backend for the chess engine.
+The position is stored as twelve 64-bit piece bitboards plus occupancy masks. Squares are numbered
+row * 8 + col, with row 0 being black's back rank, the same layout as GameState.board.
+BitboardGameState keeps the public API of ChessEngine.GameState (makeMove, undoMove, getValidMoves, board)
+so ChessAI and ChessMain can use either backend.
+"""
+import ChessEngine
+from ChessEngine import Move, ZOBRIST_CASTLING, ZOBRIST_ENPASSANT, zobristMoveDelta, evalMoveDelta, parseFEN, \
+    WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE, ALL_CASTLING, CASTLING_MASKS, UNDO_STACK_SIZE
+
+FULL_BOARD = (1 << 64) - 1
+SQUARE_COORDS = tuple((square >> 3, square & 7) for square in range(64))
+PIECES = ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")
+PIECE_KEYS = {"w": PIECES[:6], "b": PIECES[6:]}  # pawn, knight, bishop, rook, queen, king of each colour
+
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+ROW_2 = 0xFF << 16  # row 2: squares reached by a single black pawn push from its start row
+ROW_5 = 0xFF << 40  # row 5: squares reached by a single white pawn push from its start row
+
+KNIGHT_OFFSETS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+KING_OFFSETS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+ROOK_LINES = (((0, -1), (0, 1)), ((-1, 0), (1, 0)))  # rank, file
+BISHOP_LINES = (((-1, -1), (1, 1)), ((-1, 1), (1, -1)))  # diagonal, anti-diagonal
+
+
+def _raySquares(square, direction):
+    """
+    Squares reached from square in one direction on an empty board, nearest first.
+    """
+    row, col = SQUARE_COORDS[square]
+    squares = []
+    row += direction[0]
+    col += direction[1]
+    while 0 <= row <= 7 and 0 <= col <= 7:
+        squares.append(row * 8 + col)
+        row += direction[0]
+        col += direction[1]
+    return squares
+
+
+def _slidingAttacks(square, directions, occupied):
+    """
+    Attacks of a slider on square along the given directions, stopping at the first occupied square.
+    """
+    attacks = 0
+    for direction in directions:
+        for target in _raySquares(square, direction):
+            attacks |= 1 << target
+            if occupied & (1 << target):
+                break
+    return attacks
+
+
+def _buildLeaperAttacks(offsets):
+    attacks = []
+    for row, col in SQUARE_COORDS:
+        mask = 0
+        for d_row, d_col in offsets:
+            if 0 <= row + d_row <= 7 and 0 <= col + d_col <= 7:
+                mask |= 1 << ((row + d_row) * 8 + col + d_col)
+        attacks.append(mask)
+    return attacks
+
+
+def _buildLineTables(directions):
+    """
+    For every square, the relevant occupancy mask of one line (both directions, edge squares excluded)
+    and a dict mapping each occupancy of that mask to the attacked squares on the line.
+    """
+    masks = []
+    tables = []
+    for square in range(64):
+        mask = 0
+        for direction in directions:
+            for target in _raySquares(square, direction)[:-1]:
+                mask |= 1 << target
+        table = {}
+        subset = 0
+        while True:  # enumerate every subset of mask
+            table[subset] = _slidingAttacks(square, directions, subset)
+            subset = (subset - mask) & mask
+            if subset == 0:
+                break
+        masks.append(mask)
+        tables.append(table)
+    return masks, tables
+
+
+KNIGHT_ATTACKS = _buildLeaperAttacks(KNIGHT_OFFSETS)
+KING_ATTACKS = _buildLeaperAttacks(KING_OFFSETS)
+# squares attacked by a pawn of the given colour standing on the square
+PAWN_ATTACKS = {"w": _buildLeaperAttacks(((-1, -1), (-1, 1))), "b": _buildLeaperAttacks(((1, -1), (1, 1)))}
+
+RANK_MASKS, RANK_ATTACKS = _buildLineTables(ROOK_LINES[0])
+FILE_MASKS, FILE_ATTACKS = _buildLineTables(ROOK_LINES[1])
+DIAGONAL_MASKS, DIAGONAL_ATTACKS = _buildLineTables(BISHOP_LINES[0])
+ANTI_DIAGONAL_MASKS, ANTI_DIAGONAL_ATTACKS = _buildLineTables(BISHOP_LINES[1])
+
+# attacks on an empty board, used to find pinning pieces
+ROOK_RAYS = [_slidingAttacks(square, ROOK_LINES[0] + ROOK_LINES[1], 0) for square in range(64)]
+BISHOP_RAYS = [_slidingAttacks(square, BISHOP_LINES[0] + BISHOP_LINES[1], 0) for square in range(64)]
+
+# BETWEEN[a][b] holds the squares strictly between a and b when they share a line, otherwise 0
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _square in range(64):
+    for _direction in KING_OFFSETS:
+        _between = 0
+        for _target in _raySquares(_square, _direction):
+            BETWEEN[_square][_target] = _between
+            _between |= 1 << _target
+
+
+def rookAttacks(square, occupied):
+    return RANK_ATTACKS[square][occupied & RANK_MASKS[square]] | FILE_ATTACKS[square][occupied & FILE_MASKS[square]]
+
+
+def bishopAttacks(square, occupied):
+    return (DIAGONAL_ATTACKS[square][occupied & DIAGONAL_MASKS[square]] |
+            ANTI_DIAGONAL_ATTACKS[square][occupied & ANTI_DIAGONAL_MASKS[square]])
+
+
+def squares(bitboard):
+    """
+    Yield the square index of every set bit, lowest first.
+    """
+    while bitboard:
+        bit = bitboard & -bitboard
+        yield bit.bit_length() - 1
+        bitboard ^= bit
+
+
+PIECE_CODES = {piece: code for code, piece in enumerate(("--",) + PIECES)}
+# moves are never modified once generated, so each distinct (start, end, piece moved, piece captured) move is built
+# once and reused: packed key = captured << 16 | moved << 12 | start << 6 | end
+MOVE_CACHE = {}
+
+
+def _appendMoves(moves, start, targets, board, enemy):
+    """
+    Append a move from start to every square of targets. enemy is the occupancy mask of the side not moving.
+    """
+    cache = MOVE_CACHE
+    base = PIECE_CODES[board[start >> 3][start & 7]] << 12 | start << 6
+    while targets:
+        bit = targets & -targets
+        targets ^= bit
+        end = bit.bit_length() - 1
+        key = base | end
+        if bit & enemy:
+            key |= PIECE_CODES[board[end >> 3][end & 7]] << 16
+        move = cache.get(key)
+        if move is None:
+            move = cache[key] = Move(SQUARE_COORDS[start], SQUARE_COORDS[end], board)
+        moves.append(move)
+
+
+class BitboardGameState(ChessEngine.GameState):
+    split_stages = True
+
+    def __init__(self):
+        # board is a view of the bitboards for Move and the UI, makeMove/undoMove only write the squares they touch
+        self.board = [
+            ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
+            ["bp", "bp", "bp", "bp", "bp", "bp", "bp", "bp"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["--", "--", "--", "--", "--", "--", "--", "--"],
+            ["wp", "wp", "wp", "wp", "wp", "wp", "wp", "wp"],
+            ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"]]
+        self.white_to_move = True
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+        self.pins = []
+        self.checks = []
+        self.underpromotions = False
+        self.castling_rights = ALL_CASTLING
+        self.enpassant_square = -1  # square where en-passant capture is possible, -1 if none
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.undo_stack = [[None, 0, -1, 0, 0, 0] for _ in range(UNDO_STACK_SIZE)]  # same records as GameState
+        self.bitboards = {}
+        self.occupancy = {}
+        self.occupied = 0
+        self.loadBitboards()
+
+    def loadFEN(self, fen):
+        """
+        Set up the position of a FEN string, the move history starts empty.
+        """
+        self.setPosition(*parseFEN(fen))
+
+    def setPosition(self, board, white_to_move, castling_rights, enpassant, halfmove_clock=0, fullmove_number=1):
+        """
+        Set up a position from the fields parseFEN returns, the move history starts empty. board is used as is.
+        """
+        self.white_to_move = white_to_move
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.board = board
+        self.castling_rights = castling_rights
+        self.enpassant_square = enpassant[0] * 8 + enpassant[1] if enpassant else -1
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.loadBitboards()
+
+    def loadBitboards(self):
+        """
+        Rebuild the piece bitboards and occupancy masks from self.board.
+        """
+        self.bitboards = dict.fromkeys(PIECES, 0)
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    self.bitboards[piece] |= 1 << (row * 8 + col)
+        self.occupancy = {color: self.bitboards[keys[0]] | self.bitboards[keys[1]] | self.bitboards[keys[2]] |
+                          self.bitboards[keys[3]] | self.bitboards[keys[4]] | self.bitboards[keys[5]]
+                          for color, keys in PIECE_KEYS.items()}
+        self.occupied = self.occupancy["w"] | self.occupancy["b"]
+        self.zobrist_key = self.computeZobristKey()
+        self.eval_score = self.computeEvalScore()
+
+    # the GameState attributes below are derived from the bitboard state
+    @property
+    def white_king_location(self):
+        return SQUARE_COORDS[self.bitboards["wK"].bit_length() - 1]
+
+    @property
+    def black_king_location(self):
+        return SQUARE_COORDS[self.bitboards["bK"].bit_length() - 1]
+
+    @property
+    def enpassant_possible(self):
+        return SQUARE_COORDS[self.enpassant_square] if self.enpassant_square >= 0 else ()
+
+    def makeMove(self, move):
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        piece = move.piece_moved
+        captured = move.piece_captured
+        color = piece[0]
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        board = self.board
+        old_castling = self.castling_rights
+        old_enpassant = self.enpassant_square
+        self.saveUndoRecord(move, old_enpassant)
+
+        end_bit = 1 << end
+        move_bits = (1 << start) | end_bit
+        bitboards[piece] ^= move_bits
+        occupancy[color] ^= move_bits
+        board[move.start_row][move.start_col] = "--"
+        board[move.end_row][move.end_col] = piece
+
+        if move.is_enpassant_move:
+            capture_bit = 1 << (move.start_row * 8 + move.end_col)
+            bitboards[captured] ^= capture_bit
+            occupancy[captured[0]] ^= capture_bit
+            board[move.start_row][move.end_col] = "--"
+        elif captured != "--":
+            bitboards[captured] ^= end_bit
+            occupancy[captured[0]] ^= end_bit
+
+        if move.is_pawn_promotion:
+            promoted_piece = color + move.promotion_piece
+            bitboards[piece] ^= end_bit
+            bitboards[promoted_piece] |= end_bit
+            board[move.end_row][move.end_col] = promoted_piece
+        elif move.is_castle_move:
+            if move.end_col - move.start_col == 2:  # king-side
+                rook_start, rook_end = end + 1, end - 1
+            else:  # queen-side
+                rook_start, rook_end = end - 2, end + 1
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            bitboards[color + "R"] ^= rook_bits
+            occupancy[color] ^= rook_bits
+            board[move.end_row][rook_end & 7] = color + "R"
+            board[move.end_row][rook_start & 7] = "--"
+
+        self.occupied = occupancy["w"] | occupancy["b"]
+        self.castling_rights &= CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        if piece[1] == "p" and abs(end - start) == 16:  # only on 2 square pawn advance
+            self.enpassant_square = (start + end) // 2
+        else:
+            self.enpassant_square = -1
+
+        # update the Zobrist key with the parts of the position that changed
+        key = self.zobrist_key ^ zobristMoveDelta(move)
+        if old_castling != self.castling_rights:
+            key ^= ZOBRIST_CASTLING[old_castling] ^ ZOBRIST_CASTLING[self.castling_rights]
+        if old_enpassant >= 0:
+            key ^= ZOBRIST_ENPASSANT[old_enpassant & 7]
+        if self.enpassant_square >= 0:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_square & 7]
+        self.zobrist_key = key
+        self.eval_score += evalMoveDelta(move)
+        self.halfmove_clock = 0 if captured != "--" or piece[1] == "p" else self.halfmove_clock + 1
+        self.move_log.append(move)
+        self.white_to_move = not self.white_to_move
+        if self.white_to_move:
+            self.fullmove_number += 1
+        if ChessEngine.ZOBRIST_DEBUG:
+            self.checkZobristKey()
+        if ChessEngine.EVAL_DEBUG:
+            self.checkEvalScore()
+
+    def undoMove(self):
+        if len(self.move_log) != 0:  # make sure that there is a move to undo
+            move = self.move_log.pop()
+            _, self.castling_rights, self.enpassant_square, self.zobrist_key, self.eval_score, \
+                self.halfmove_clock = self.undo_stack[len(self.move_log)]
+            start = move.start_row * 8 + move.start_col
+            end = move.end_row * 8 + move.end_col
+            piece = move.piece_moved
+            captured = move.piece_captured
+            color = piece[0]
+            bitboards = self.bitboards
+            occupancy = self.occupancy
+            board = self.board
+
+            end_bit = 1 << end
+            if move.is_pawn_promotion:
+                bitboards[color + move.promotion_piece] ^= end_bit
+                bitboards[piece] ^= end_bit
+            elif move.is_castle_move:
+                if move.end_col - move.start_col == 2:  # king-side
+                    rook_start, rook_end = end + 1, end - 1
+                else:  # queen-side
+                    rook_start, rook_end = end - 2, end + 1
+                rook_bits = (1 << rook_start) | (1 << rook_end)
+                bitboards[color + "R"] ^= rook_bits
+                occupancy[color] ^= rook_bits
+                board[move.end_row][rook_start & 7] = color + "R"
+                board[move.end_row][rook_end & 7] = "--"
+
+            move_bits = (1 << start) | end_bit
+            bitboards[piece] ^= move_bits
+            occupancy[color] ^= move_bits
+            board[move.start_row][move.start_col] = piece
+            board[move.end_row][move.end_col] = captured
+
+            if move.is_enpassant_move:
+                capture_bit = 1 << (move.start_row * 8 + move.end_col)
+                bitboards[captured] ^= capture_bit
+                occupancy[captured[0]] ^= capture_bit
+                board[move.end_row][move.end_col] = "--"
+                board[move.start_row][move.end_col] = captured
+            elif captured != "--":
+                bitboards[captured] ^= end_bit
+                occupancy[captured[0]] ^= end_bit
+
+            self.occupied = occupancy["w"] | occupancy["b"]
+            if self.white_to_move:
+                self.fullmove_number -= 1
+            self.white_to_move = not self.white_to_move
+            if ChessEngine.ZOBRIST_DEBUG:
+                self.checkZobristKey()
+            if ChessEngine.EVAL_DEBUG:
+                self.checkEvalScore()
+            self.checkmate = False
+            self.stalemate = False
+
+    def isSquareAttacked(self, square, attacker_color, occupied):
+        """
+        Determine if a piece of attacker_color attacks the square, given the occupancy mask to slide through.
+        """
+        pawn, knight, bishop, rook, queen, king = PIECE_KEYS[attacker_color]
+        bitboards = self.bitboards
+        return bool((KNIGHT_ATTACKS[square] & bitboards[knight]) or
+                    (PAWN_ATTACKS["b" if attacker_color == "w" else "w"][square] & bitboards[pawn]) or
+                    (KING_ATTACKS[square] & bitboards[king]) or
+                    (rookAttacks(square, occupied) & (bitboards[rook] | bitboards[queen])) or
+                    (bishopAttacks(square, occupied) & (bitboards[bishop] | bitboards[queen])))
+
+    def pieceCount(self):
+        return bin(self.occupied).count("1")
+
+    def occupiedSquares(self):
+        return squares(self.occupied)
+
+    def inCheck(self):
+        """
+        Determine if a current player is in check
+        """
+        color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        return self.isSquareAttacked(self.bitboards[color + "K"].bit_length() - 1, enemy_color, self.occupied)
+
+    def squareUnderAttack(self, row, col):
+        """
+        Determine if enemy can attack the square row col
+        """
+        return self.isSquareAttacked(row * 8 + col, "b" if self.white_to_move else "w", self.occupied)
+
+    def getValidMoves(self):
+        """
+        All moves considering checks, generated directly as legal moves from check and pin masks.
+        """
+        return self.generateLegalMoves(False)
+
+    def getValidCaptures(self):
+        """
+        Legal captures only, for the quiescence search. In check all evasions are returned.
+        Without moves the checkmate flag is set, stalemate can't be told apart from having no captures.
+        """
+        return self.generateLegalMoves(True)
+
+    def getValidQuiets(self):
+        """
+        Legal moves that don't capture, the quiet stage of generateStagedMoves.
+        """
+        return self.generateLegalMoves(False, quiets_only=True)
+
+    def isLegalMove(self, move):
+        """
+        Whether move, e.g. a hash or killer move found in another position, is legal here:
+        a pseudo-legal test on the bitboards, then make/undo to see if the own king is left attacked.
+        """
+        board = self.board
+        color, enemy_color = ("w", "b") if self.white_to_move else ("b", "w")
+        if board[move.start_row][move.start_col] != move.piece_moved or move.piece_moved[0] != color:
+            return False
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        if move.is_castle_move or move.is_enpassant_move:
+            moves = []
+            if move.is_castle_move:
+                if not self.inCheck():
+                    self.addCastleMoves(moves, color)
+            elif end == self.enpassant_square:
+                self.addEnpassantMoves(moves, color, self.bitboards[color + "K"].bit_length() - 1)
+            return move in moves
+        if board[move.end_row][move.end_col] != move.piece_captured:
+            return False
+        if move.is_pawn_promotion and move.promotion_piece != "Q" and not self.underpromotions:
+            return False
+        piece = move.piece_moved[1]
+        end_bit = 1 << end
+        occupied = self.occupied
+        if piece == "p":
+            direction = -8 if color == "w" else 8
+            if move.is_capture:
+                reachable = PAWN_ATTACKS[color][start] & end_bit
+            elif end == start + direction:
+                reachable = True
+            else:
+                reachable = end == start + 2 * direction and start >> 3 == (6 if color == "w" else 1) and \
+                    not occupied & (1 << (start + direction))
+        elif piece == "N":
+            reachable = KNIGHT_ATTACKS[start] & end_bit
+        elif piece == "B":
+            reachable = bishopAttacks(start, occupied) & end_bit
+        elif piece == "R":
+            reachable = rookAttacks(start, occupied) & end_bit
+        elif piece == "Q":
+            reachable = (bishopAttacks(start, occupied) | rookAttacks(start, occupied)) & end_bit
+        else:
+            reachable = KING_ATTACKS[start] & end_bit
+        if not reachable:
+            return False
+        self.makeMove(move)
+        legal = not self.isSquareAttacked(self.bitboards[color + "K"].bit_length() - 1, enemy_color, self.occupied)
+        self.undoMove()
+        return legal
+
+    def generateLegalMoves(self, captures_only, quiets_only=False):
+        moves = []
+        bitboards = self.bitboards
+        if self.white_to_move:
+            color, enemy_color = "w", "b"
+        else:
+            color, enemy_color = "b", "w"
+        own = self.occupancy[color]
+        occupied = self.occupied
+        enemy_pawn, enemy_knight, enemy_bishop, enemy_rook, enemy_queen, enemy_king = PIECE_KEYS[enemy_color]
+        enemy_pawns = bitboards[enemy_pawn]
+        enemy_knights = bitboards[enemy_knight]
+        enemy_orthogonal = bitboards[enemy_rook] | bitboards[enemy_queen]
+        enemy_diagonal = bitboards[enemy_bishop] | bitboards[enemy_queen]
+        king_square = bitboards[color + "K"].bit_length() - 1
+
+        checkers = ((KNIGHT_ATTACKS[king_square] & enemy_knights) |
+                    (PAWN_ATTACKS[color][king_square] & enemy_pawns) |
+                    (rookAttacks(king_square, occupied) & enemy_orthogonal) |
+                    (bishopAttacks(king_square, occupied) & enemy_diagonal))
+        self.in_check = checkers != 0
+
+        # king moves: the king is lifted off the board so sliders attack through its current square
+        king_occupied = occupied ^ (1 << king_square)
+        enemy_king_attacks = KING_ATTACKS[bitboards[enemy_king].bit_length() - 1]
+        pawn_attacks = PAWN_ATTACKS[color]
+        safe = 0
+        targets = KING_ATTACKS[king_square] & ~own & ~enemy_king_attacks
+        if captures_only and not checkers:
+            targets &= self.occupancy[enemy_color]
+        elif quiets_only:
+            targets &= ~self.occupancy[enemy_color]
+        while targets:
+            bit = targets & -targets
+            targets ^= bit
+            end = bit.bit_length() - 1
+            if not ((KNIGHT_ATTACKS[end] & enemy_knights) or (pawn_attacks[end] & enemy_pawns) or
+                    (rookAttacks(end, king_occupied) & enemy_orthogonal) or
+                    (bishopAttacks(end, king_occupied) & enemy_diagonal)):
+                safe |= bit
+        _appendMoves(moves, king_square, safe, self.board, self.occupancy[enemy_color])
+
+        if not checkers & (checkers - 1):  # not double check, other pieces can move too
+            if checkers:  # capture the checking piece or block the check
+                target_mask = checkers | BETWEEN[king_square][checkers.bit_length() - 1]
+            elif captures_only:
+                target_mask = self.occupancy[enemy_color]
+            else:
+                target_mask = ~own & FULL_BOARD
+            if quiets_only:
+                target_mask &= ~occupied & FULL_BOARD
+
+            # pinned pieces may only move along the line between the king and the pinning piece
+            pin_masks = {}
+            snipers = (ROOK_RAYS[king_square] & enemy_orthogonal) | (BISHOP_RAYS[king_square] & enemy_diagonal)
+            while snipers:
+                bit = snipers & -snipers
+                snipers ^= bit
+                between = BETWEEN[king_square][bit.bit_length() - 1]
+                blockers = between & occupied
+                if blockers & own and not blockers & (blockers - 1):
+                    pin_masks[blockers.bit_length() - 1] = between | bit
+
+            self.addPieceMoves(moves, color, target_mask, pin_masks)
+            if not quiets_only:
+                self.addEnpassantMoves(moves, color, king_square)
+            if not checkers and not captures_only:
+                self.addCastleMoves(moves, color)
+        if self.underpromotions:
+            self.addUnderpromotions(moves)
+
+        if len(moves) == 0:
+            if checkers and not quiets_only:
+                self.checkmate = True
+            elif captures_only or quiets_only:
+                self.checkmate = False
+                self.stalemate = False
+            else:
+                # TODO stalemate on repeated moves
+                self.stalemate = True
+        else:
+            self.checkmate = False
+            self.stalemate = False
+        return moves
+
+    def getAllPossibleMoves(self):
+        """
+        All moves without considering checks.
+        """
+        moves = []
+        color = "w" if self.white_to_move else "b"
+        own = self.occupancy[color]
+        king_square = self.bitboards[color + "K"].bit_length() - 1
+        _appendMoves(moves, king_square, KING_ATTACKS[king_square] & ~own, self.board,
+                     self.occupancy["b" if self.white_to_move else "w"])
+        self.addPieceMoves(moves, color, ~own & FULL_BOARD, {})
+        self.addEnpassantMoves(moves, color, -1)
+        return moves
+
+    def addPieceMoves(self, moves, color, target_mask, pin_masks):
+        """
+        Add the pawn, knight, bishop, rook and queen moves that land on target_mask.
+        pin_masks maps each pinned square to the squares its piece may still move to.
+        """
+        board = self.board
+        bitboards = self.bitboards
+        pawn, knight, bishop, rook, queen, _ = PIECE_KEYS[color]
+        enemy = self.occupancy["b" if color == "w" else "w"]
+        occupied = self.occupied
+        empty = ~occupied & FULL_BOARD
+        pinned = 0
+        for square in pin_masks:
+            pinned |= 1 << square
+
+        # pawns that are not pinned are moved set-wise, start = end - offset
+        pawns = bitboards[pawn] & ~pinned
+        if color == "w":
+            single_pushes = (pawns >> 8) & empty
+            double_pushes = ((single_pushes & ROW_5) >> 8) & empty & target_mask
+            pawn_targets = ((single_pushes & target_mask, -8), (double_pushes, -16),
+                            (((pawns & ~FILE_A) >> 9) & enemy & target_mask, -9),
+                            (((pawns & ~FILE_H) >> 7) & enemy & target_mask, -7))
+        else:
+            single_pushes = (pawns << 8) & empty
+            double_pushes = ((single_pushes & ROW_2) << 8) & empty & target_mask
+            pawn_targets = ((single_pushes & target_mask, 8), (double_pushes, 16),
+                            (((pawns & ~FILE_A) << 7) & enemy & target_mask, 7),
+                            (((pawns & ~FILE_H) << 9) & enemy & target_mask, 9))
+        cache = MOVE_CACHE
+        pawn_code = PIECE_CODES[pawn] << 12
+        for targets, offset in pawn_targets:
+            while targets:
+                bit = targets & -targets
+                targets ^= bit
+                end = bit.bit_length() - 1
+                start = end - offset
+                key = pawn_code | start << 6 | end
+                if bit & enemy:
+                    key |= PIECE_CODES[board[end >> 3][end & 7]] << 16
+                move = cache.get(key)
+                if move is None:
+                    move = cache[key] = Move(SQUARE_COORDS[start], SQUARE_COORDS[end], board)
+                moves.append(move)
+
+        # pinned pawns are rare, move them one at a time
+        direction = -8 if color == "w" else 8
+        start_row = 6 if color == "w" else 1
+        for start in squares(bitboards[pawn] & pinned):
+            allowed = pin_masks[start] & target_mask
+            push = start + direction
+            targets = PAWN_ATTACKS[color][start] & enemy & allowed
+            if empty & (1 << push):
+                targets |= allowed & (1 << push)
+                if start >> 3 == start_row:
+                    targets |= empty & allowed & (1 << (push + direction))
+            _appendMoves(moves, start, targets, board, enemy)
+
+        # pinned knights can never move
+        for start in squares(bitboards[knight] & ~pinned):
+            _appendMoves(moves, start, KNIGHT_ATTACKS[start] & target_mask, board, enemy)
+
+        for start in squares(bitboards[bishop] | bitboards[queen]):
+            targets = bishopAttacks(start, occupied) & target_mask
+            if pinned & (1 << start):
+                targets &= pin_masks[start]
+            _appendMoves(moves, start, targets, board, enemy)
+        for start in squares(bitboards[rook] | bitboards[queen]):
+            targets = rookAttacks(start, occupied) & target_mask
+            if pinned & (1 << start):
+                targets &= pin_masks[start]
+            _appendMoves(moves, start, targets, board, enemy)
+
+    def addEnpassantMoves(self, moves, color, king_square):
+        """
+        Add en-passant captures. With a king_square, each capture is checked by removing both pawns from the board,
+        which covers pins, checks and the horizontal discovered check at once.
+        """
+        enpassant_square = self.enpassant_square
+        if enpassant_square < 0:
+            return
+        bitboards = self.bitboards
+        enemy_color = "b" if color == "w" else "w"
+        enemy_pawn, enemy_knight, enemy_bishop, enemy_rook, enemy_queen, _ = PIECE_KEYS[enemy_color]
+        captured_square = enpassant_square + (8 if color == "w" else -8)
+        for start in squares(PAWN_ATTACKS[enemy_color][enpassant_square] & bitboards[color + "p"]):
+            if king_square >= 0:
+                occupied = (self.occupied ^ (1 << start) ^ (1 << captured_square)) | (1 << enpassant_square)
+                if ((rookAttacks(king_square, occupied) & (bitboards[enemy_rook] | bitboards[enemy_queen])) or
+                        (bishopAttacks(king_square, occupied) & (bitboards[enemy_bishop] | bitboards[enemy_queen])) or
+                        (KNIGHT_ATTACKS[king_square] & bitboards[enemy_knight]) or
+                        (PAWN_ATTACKS[color][king_square] & bitboards[enemy_pawn] & ~(1 << captured_square))):
+                    continue
+            moves.append(Move(SQUARE_COORDS[start], SQUARE_COORDS[enpassant_square], self.board,
+                              is_enpassant_move=True))
+
+    def addCastleMoves(self, moves, color):
+        """
+        Add the castle moves of a king that is not in check.
+        """
+        occupied = self.occupied
+        if color == "w":
+            row, kingside, queenside, enemy_color = 7, WHITE_KINGSIDE, WHITE_QUEENSIDE, "b"
+        else:
+            row, kingside, queenside, enemy_color = 0, BLACK_KINGSIDE, BLACK_QUEENSIDE, "w"
+        king_square = row * 8 + 4
+        if self.castling_rights & kingside and not occupied & (0b11 << (king_square + 1)):
+            if not self.isSquareAttacked(king_square + 1, enemy_color, occupied) and \
+                    not self.isSquareAttacked(king_square + 2, enemy_color, occupied):
+                moves.append(Move((row, 4), (row, 6), self.board, is_castle_move=True))
+        if self.castling_rights & queenside and not occupied & (0b111 << (king_square - 3)):
+            if not self.isSquareAttacked(king_square - 1, enemy_color, occupied) and \
+                    not self.isSquareAttacked(king_square - 2, enemy_color, occupied):
+                moves.append(Move((row, 4), (row, 2), self.board, is_castle_move=True))
+
+
+ChessEngine.ENGINES["bitboard"] = BitboardGameState
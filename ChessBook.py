@@ -0,0 +1,171 @@
+"""
+Opening book: a sorted binary file of (zobrist key, move code, weight) records, memory-mapped and binary-searched,
+so opening it costs nothing and a lookup only touches the pages it reads.
+
+python ChessBook.py games.pgn [more.pgn ...] -o opening_book.bin --plies 24 --min-count 2
+"""
+import argparse
+import mmap
+import random
+import re
+import struct
+import sys
+
+import ChessEngine
+
+BOOK_MAGIC = b"CHSBOOK1"
+BOOK_RECORD = struct.Struct(">QHH")  # zobrist key, Move.code, weight, big-endian so records sort like their keys
+BOOK_KEY = struct.Struct(">Q")
+
+SAN_PATTERN = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+PGN_TOKEN = re.compile(r"\{[^}]*\}|;[^\n]*|\$\d+|\(|\)|[^\s(){};]+")
+PGN_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+
+
+class OpeningBook:
+    """
+    Read-only view of a book file. probe() is a binary search over the mapped records.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(BOOK_MAGIC)] != BOOK_MAGIC:
+            self.close()
+            raise ValueError(path + " is not an opening book")
+        self.count = (len(self.data) - len(BOOK_MAGIC)) // BOOK_RECORD.size
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+    def probe(self, key):
+        """
+        Return [(move code, weight)] stored for the zobrist key, empty if the position is not in the book.
+        """
+        data = self.data
+        low = 0
+        high = self.count
+        while low < high:  # first record with a key >= key
+            middle = (low + high) // 2
+            if BOOK_KEY.unpack_from(data, len(BOOK_MAGIC) + middle * BOOK_RECORD.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        moves = []
+        while low < self.count:
+            record_key, code, weight = BOOK_RECORD.unpack_from(data, len(BOOK_MAGIC) + low * BOOK_RECORD.size)
+            if record_key != key:
+                break
+            moves.append((code, weight))
+            low += 1
+        return moves
+
+    def pickMove(self, game_state, valid_moves):
+        """
+        Weighted random book move for the position, or None. Codes that aren't legal (key collisions) are skipped.
+        """
+        codes = {move.code: move for move in valid_moves}
+        candidates = [(codes[code], weight) for code, weight in self.probe(game_state.zobrist_key) if code in codes]
+        if not candidates:
+            return None
+        return random.choices([move for move, _ in candidates], [weight for _, weight in candidates])[0]
+
+
+def parseSAN(san, valid_moves):
+    """
+    The move of valid_moves written as san (standard algebraic notation), ValueError if there is no single match.
+    """
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        queen_side = len(text) == 5
+        matches = [move for move in valid_moves if move.is_castle_move and (move.end_col == 2) == queen_side]
+    else:
+        match = SAN_PATTERN.match(text)
+        if match is None:
+            raise ValueError("bad SAN " + san)
+        piece, start_file, start_rank, end, promotion = match.groups()
+        end_col = ChessEngine.Move.files_to_cols[end[0]]
+        end_row = ChessEngine.Move.ranks_to_rows[end[1]]
+        matches = [move for move in valid_moves
+                   if move.piece_moved[1] == (piece or "p") and move.end_row == end_row and move.end_col == end_col
+                   and (start_file is None or move.start_col == ChessEngine.Move.files_to_cols[start_file])
+                   and (start_rank is None or move.start_row == ChessEngine.Move.ranks_to_rows[start_rank])
+                   and move.promotion_piece == promotion]
+    if len(matches) != 1:
+        raise ValueError("SAN " + san + " matches " + str(len(matches)) + " moves")
+    return matches[0]
+
+
+def readPGNGames(lines):
+    """
+    Yield the SAN moves of every game in PGN text, without comments, variations, NAGs and move numbers.
+    """
+    moves = []
+    depth = 0  # nesting of variations
+    for line in lines:
+        if line.startswith("["):
+            if moves:
+                yield moves
+                moves = []
+            continue
+        for token in PGN_TOKEN.findall(line):
+            if token == "(":
+                depth += 1
+            elif token == ")":
+                depth -= 1
+            elif depth > 0 or token[0] in "{;$":
+                continue
+            elif token in PGN_RESULTS:
+                yield moves
+                moves = []
+            else:
+                token = token.split(".")[-1]  # "12.e4", "12...e5" and bare "12."
+                if token:
+                    moves.append(token)
+    if moves:
+        yield moves
+
+
+def buildBook(pgn_paths, book_path, plies=24, min_count=1):
+    """
+    Count the moves played in the first plies of every PGN game and write the ones played at least min_count
+    times from a position as a book. Returns the number of records written.
+    """
+    counts = {}
+    for pgn_path in pgn_paths:
+        with open(pgn_path, encoding="utf-8", errors="replace") as pgn:
+            for sans in readPGNGames(pgn):
+                game_state = ChessEngine.GameState()
+                game_state.underpromotions = True
+                for san in sans[:plies]:
+                    try:
+                        move = parseSAN(san, game_state.getValidMoves())
+                    except ValueError:
+                        break  # broken or non-standard game, keep the moves before it
+                    position = counts.setdefault(game_state.zobrist_key, {})
+                    position[move.code] = position.get(move.code, 0) + 1
+                    game_state.makeMove(move)
+    records = sorted((key, code, min(count, 0xFFFF))
+                     for key, position in counts.items() for code, count in position.items() if count >= min_count)
+    with open(book_path, "wb") as book:
+        book.write(BOOK_MAGIC)
+        for record in records:
+            book.write(BOOK_RECORD.pack(*record))
+    return len(records)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN files.")
+    parser.add_argument("pgn", nargs="+", help="PGN files to read")
+    parser.add_argument("-o", "--output", default="opening_book.bin")
+    parser.add_argument("--plies", type=int, default=24, help="moves per game to keep (default 24)")
+    parser.add_argument("--min-count", type=int, default=1, help="drop moves played fewer times (default 1)")
+    args = parser.parse_args(argv)
+    records = buildBook(args.pgn, args.output, args.plies, args.min_count)
+    print("%d book moves written to %s" % (records, args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,258 @@
+import random
 
+# Zobrist hashing: one random 64-bit key per (piece, square), per castling rights mask, per en-passant file
+# and one for black to move. The generator is seeded so every process gets the same key for the same position.
+_zobrist_random = random.Random(20240601)
+ZOBRIST_PIECES = {piece: [_zobrist_random.getrandbits(64) for _ in range(64)]
+                  for piece in ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK")}
+ZOBRIST_CASTLING = [_zobrist_random.getrandbits(64) for _ in range(16)]  # indexed by the castling rights mask
+ZOBRIST_ENPASSANT = [_zobrist_random.getrandbits(64) for _ in range(8)]  # indexed by the en-passant column
+ZOBRIST_BLACK_TO_MOVE = _zobrist_random.getrandbits(64)
+ZOBRIST_DEBUG = False  # check the incremental key against computeZobristKey() after every makeMove/undoMove
+
+# castling rights as a 4-bit mask
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING = 15
+
+# castling_rights &= CASTLING_MASKS[start] & CASTLING_MASKS[end] clears the rights of a king or rook that moves
+# or of a rook that gets captured, squares are row * 8 + col
+CASTLING_MASKS = [ALL_CASTLING] * 64
+CASTLING_MASKS[0] = ALL_CASTLING & ~BLACK_QUEENSIDE
+CASTLING_MASKS[4] = ALL_CASTLING & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[7] = ALL_CASTLING & ~BLACK_KINGSIDE
+CASTLING_MASKS[56] = ALL_CASTLING & ~WHITE_QUEENSIDE
+CASTLING_MASKS[60] = ALL_CASTLING & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[63] = ALL_CASTLING & ~WHITE_KINGSIDE
+
+PIECE_SQUARES_DEBUG = False  # check piece_squares against the board after every makeMove/undoMove
+UNDO_STACK_SIZE = 256  # undo records allocated up front, the stack doubles when a game gets longer
+
+
+def zobristMoveDelta(move):
+    """
+    XOR of the piece keys changed by the move (moved, captured, promoted piece and castling rook)
+    and of the side to move key. Applying it twice cancels out, so makeMove and undoMove both use it.
+    """
+    pieces = ZOBRIST_PIECES
+    start = move.start_row * 8 + move.start_col
+    end = move.end_row * 8 + move.end_col
+    key = ZOBRIST_BLACK_TO_MOVE ^ pieces[move.piece_moved][start]
+    if move.is_pawn_promotion:
+        key ^= pieces[move.piece_moved[0] + move.promotion_piece][end]
+    else:
+        key ^= pieces[move.piece_moved][end]
+    if move.is_enpassant_move:
+        key ^= pieces[move.piece_captured][move.start_row * 8 + move.end_col]
+    elif move.piece_captured != "--":
+        key ^= pieces[move.piece_captured][end]
+    if move.is_castle_move:
+        rook = pieces[move.piece_moved[0] + "R"]
+        if move.end_col - move.start_col == 2:  # king-side
+            key ^= rook[end + 1] ^ rook[end - 1]
+        else:  # queen-side
+            key ^= rook[end - 2] ^ rook[end + 1]
+    return key
+
+
+piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
+#Đánh giá mức độ quan trọng của từng quân cờ (VD: 0 là không thể để mất,Q là quan trọng nhất và chỉ mang tính tương đối)
+
+knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
+                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
+                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
+                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
+                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
+                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
+                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
+                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
+                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
+                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
+
+rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
+
+queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
+                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
+
+pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
+               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
+               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
+               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
+               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
+               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
+
+piece_position_scores = {"wN": knight_scores,
+                         "bN": knight_scores[::-1],
+                         "wB": bishop_scores,
+                         "bB": bishop_scores[::-1],
+                         "wQ": queen_scores,
+                         "bQ": queen_scores[::-1],
+                         "wR": rook_scores,
+                         "bR": rook_scores[::-1],
+                         "wp": pawn_scores,
+                         "bp": pawn_scores[::-1]}
+
+# Material plus piece-square score of each piece on each square in centipawns, negative for black.
+# Integers so the incrementally updated GameState.eval_score never drifts from a full recount.
+PIECE_SQUARE_SCORES = {}
+for _piece in ("wp", "wN", "wB", "wR", "wQ", "wK", "bp", "bN", "bB", "bR", "bQ", "bK"):
+    _sign = 1 if _piece[0] == "w" else -1
+    _position_scores = piece_position_scores.get(_piece, [[0] * 8] * 8)  # the king has no position score
+    PIECE_SQUARE_SCORES[_piece] = [_sign * round((piece_score[_piece[1]] + _position_scores[row][col]) * 100)
+                                   for row in range(8) for col in range(8)]
+EVAL_DEBUG = False  # check the incremental eval_score against computeEvalScore() after every makeMove/undoMove
+
+
+def evalMoveDelta(move):
+    """
+    Change of the material and piece-square score made by the move (moved, captured, promoted piece and
+    castling rook). makeMove adds it and undoMove subtracts it.
+    """
+    scores = PIECE_SQUARE_SCORES
+    start = move.start_row * 8 + move.start_col
+    end = move.end_row * 8 + move.end_col
+    delta = -scores[move.piece_moved][start]
+    if move.is_pawn_promotion:
+        delta += scores[move.piece_moved[0] + move.promotion_piece][end]
+    else:
+        delta += scores[move.piece_moved][end]
+    if move.is_enpassant_move:
+        delta -= scores[move.piece_captured][move.start_row * 8 + move.end_col]
+    elif move.piece_captured != "--":
+        delta -= scores[move.piece_captured][end]
+    if move.is_castle_move:
+        rook = scores[move.piece_moved[0] + "R"]
+        if move.end_col - move.start_col == 2:  # king-side
+            delta += rook[end - 1] - rook[end + 1]
+        else:  # queen-side
+            delta += rook[end + 1] - rook[end - 2]
+    return delta
+
+
+# Generated moves are never modified, so each distinct move is built once and reused by every later generation.
+# key: (start, end, piece moved, piece captured, en passant, castle, promotion piece)
+MOVE_CACHE = {}
+
+
+def cachedMove(start_square, end_square, board, is_enpassant_move=False, is_castle_move=False, promotion_piece="Q"):
+    """
+    Same as Move(...), but returns the shared Move object when this move was generated before.
+    """
+    key = (start_square, end_square, board[start_square[0]][start_square[1]], board[end_square[0]][end_square[1]],
+           is_enpassant_move, is_castle_move, promotion_piece)
+    move = MOVE_CACHE.get(key)
+    if move is None:
+        move = MOVE_CACHE[key] = Move(start_square, end_square, board, is_enpassant_move, is_castle_move,
+                                      promotion_piece)
+    return move
+
+
+def _stepSquares(row, col, steps):
+    return [(row + row_step, col + col_step) for row_step, col_step in steps
+            if 0 <= row + row_step <= 7 and 0 <= col + col_step <= 7]
+
+
+def _raySquares(row, col, directions):
+    rays = []
+    for row_step, col_step in directions:
+        ray = []
+        end_row, end_col = row + row_step, col + col_step
+        while 0 <= end_row <= 7 and 0 <= end_col <= 7:
+            ray.append((end_row, end_col))
+            end_row += row_step
+            end_col += col_step
+        if ray:
+            rays.append(ray)
+    return rays
+
+
+# Attack tables indexed by row * 8 + col: the squares a knight or king reaches, and the squares along each
+# orthogonal / diagonal ray going outward, nearest first
+KNIGHT_SQUARES = [_stepSquares(row, col, ((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+                  for row in range(8) for col in range(8)]
+KING_SQUARES = [_stepSquares(row, col, ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+                for row in range(8) for col in range(8)]
+ORTHOGONAL_RAYS = [_raySquares(row, col, ((-1, 0), (0, -1), (1, 0), (0, 1))) for row in range(8) for col in range(8)]
+DIAGONAL_RAYS = [_raySquares(row, col, ((-1, -1), (-1, 1), (1, -1), (1, 1))) for row in range(8) for col in range(8)]
+# BETWEEN_SQUARES[start][end]: squares strictly between two squares on a rank, file or diagonal, else empty
+BETWEEN_SQUARES = [[[] for _ in range(64)] for _ in range(64)]
+for _square in range(64):
+    for _ray in ORTHOGONAL_RAYS[_square] + DIAGONAL_RAYS[_square]:
+        for _index, (_row, _col) in enumerate(_ray):
+            BETWEEN_SQUARES[_square][_row * 8 + _col] = _ray[:_index]
+
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+FEN_PIECES = {"P": "wp", "N": "wN", "B": "wB", "R": "wR", "Q": "wQ", "K": "wK",
+              "p": "bp", "n": "bN", "b": "bB", "r": "bR", "q": "bQ", "k": "bK"}
+
+
+def parseFEN(fen):
+    """
+    Split a FEN string into (board, white_to_move, castling rights, en-passant square, halfmove clock, fullmove number).
+    Castling rights are a 4-bit mask, the en-passant square is (row, col) or (). Missing move counters are 0 and 1.
+    """
+    fields = fen.split()
+    if len(fields) < 4:
+        raise ValueError("FEN needs at least 4 fields: " + fen)
+    board = []
+    for rank in fields[0].split("/"):
+        row = []
+        for char in rank:
+            if char.isdigit():
+                row.extend(["--"] * int(char))
+            elif char in FEN_PIECES:
+                row.append(FEN_PIECES[char])
+            else:
+                raise ValueError("Bad piece " + repr(char) + " in FEN: " + fen)
+        board.append(row)
+    if len(board) != 8 or any(len(row) != 8 for row in board):
+        raise ValueError("FEN board is not 8x8: " + fen)
+    if fields[1] not in ("w", "b"):
+        raise ValueError("Bad side to move in FEN: " + fen)
+    castling = fields[2]
+    castling_rights = ("K" in castling) * WHITE_KINGSIDE | ("Q" in castling) * WHITE_QUEENSIDE | \
+        ("k" in castling) * BLACK_KINGSIDE | ("q" in castling) * BLACK_QUEENSIDE
+    enpassant = ()
+    if fields[3] != "-":
+        enpassant = (Move.ranks_to_rows[fields[3][1]], Move.files_to_cols[fields[3][0]])
+    try:
+        halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+    except ValueError:
+        raise ValueError("Bad move counters in FEN: " + fen) from None
+    return board, fields[1] == "w", castling_rights, enpassant, halfmove_clock, fullmove_number
 
 
 class GameState:
+    # whether getValidCaptures and getValidQuiets are cheaper than one getValidMoves, generateStagedMoves then calls
+    # them one stage at a time, otherwise it splits getValidMoves
+    split_stages = False
+
     def __init__(self):
        
         self.board = [
@@ -24,18 +275,75 @@ class GameState:
         self.in_check = False
         self.pins = []
         self.checks = []
+        self.underpromotions = False  # also generate knight, bishop and rook promotions, the UI always promotes to queen
         self.enpassant_possible = ()  # coordinates for the square where en-passant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.castling_rights = ALL_CASTLING
+        self.halfmove_clock = 0  # plies since the last capture or pawn move
+        self.fullmove_number = 1  # starts at 1 and goes up after each black move
+        # one reusable [move, castling rights, en passant, zobrist key, eval score, halfmove clock] record per move
+        # in move_log, holding the state from before the move
+        self.undo_stack = [[None, 0, (), 0, 0, 0] for _ in range(UNDO_STACK_SIZE)]
+        self.piece_squares = self.computePieceSquares()  # {"w": set, "b": set} of occupied squares, row * 8 + col
+        self.zobrist_key = self.computeZobristKey()
+        self.eval_score = self.computeEvalScore()  # material + piece-square score in centipawns, white positive
+
+    def loadFEN(self, fen):
+        """
+        Set up the position of a FEN string, the move history starts empty.
+        """
+        self.setPosition(*parseFEN(fen))
+
+    def setPosition(self, board, white_to_move, castling_rights, enpassant, halfmove_clock=0, fullmove_number=1):
+        """
+        Set up a position from the fields parseFEN returns, the move history starts empty. board is used as is.
+        """
+        self.white_to_move = white_to_move
+        self.halfmove_clock = halfmove_clock
+        self.fullmove_number = fullmove_number
+        self.enpassant_possible = enpassant
+        self.board = board
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    self.white_king_location = (row, col)
+                elif board[row][col] == "bK":
+                    self.black_king_location = (row, col)
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.castling_rights = castling_rights
+        self.piece_squares = self.computePieceSquares()
+        self.zobrist_key = self.computeZobristKey()
+        self.eval_score = self.computeEvalScore()
+
+    def saveUndoRecord(self, move, enpassant):
+        """
+        Store the state undoMove needs in the preallocated record of the next ply, before move is made.
+        """
+        ply = len(self.move_log)
+        if ply == len(self.undo_stack):
+            self.undo_stack.extend([None, 0, (), 0, 0, 0] for _ in range(ply))
+        record = self.undo_stack[ply]
+        record[0] = move
+        record[1] = self.castling_rights
+        record[2] = enpassant
+        record[3] = self.zobrist_key
+        record[4] = self.eval_score
+        record[5] = self.halfmove_clock
 
     def makeMove(self, move):
         #Thực hiện nước đi được chọn và cập nhật trạng thái trò chơi
+        self.saveUndoRecord(move, self.enpassant_possible)
+        old_castling = self.castling_rights
+        old_enpassant = self.enpassant_possible
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move) 
         self.white_to_move = not self.white_to_move  
+        # update the move counters
+        self.halfmove_clock = 0 if move.is_capture or move.piece_moved[1] == "p" else self.halfmove_clock + 1
+        if self.white_to_move:
+            self.fullmove_number += 1
         # update king's location if moved
         if move.piece_moved == "wK":
             self.white_king_location = (move.end_row, move.end_col)
@@ -48,7 +356,7 @@ class GameState:
             #    promoted_piece = input("Promote to Q, R, B, or N:") #take this to UI later
             #    self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
             # else:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_piece
 
         # enpassant move
         if move.is_enpassant_move:
@@ -71,19 +379,38 @@ class GameState:
                     move.end_col - 2]  # moves the rook to its new square
                 self.board[move.end_row][move.end_col - 2] = '--'  # erase old rook
 
-        self.enpassant_possible_log.append(self.enpassant_possible)
+        self.movePieceSquares(move)
 
         # update quyền được phép nhập thành
         self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+
+        # update the Zobrist key with the parts of the position that changed
+        self.zobrist_key ^= zobristMoveDelta(move) ^ ZOBRIST_CASTLING[old_castling] ^ \
+            ZOBRIST_CASTLING[self.castling_rights]
+        if old_enpassant:
+            self.zobrist_key ^= ZOBRIST_ENPASSANT[old_enpassant[1]]
+        if self.enpassant_possible:
+            self.zobrist_key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        if ZOBRIST_DEBUG:
+            self.checkZobristKey()
+        self.eval_score += evalMoveDelta(move)
+        if EVAL_DEBUG:
+            self.checkEvalScore()
+        if PIECE_SQUARES_DEBUG:
+            self.checkPieceSquares()
 
     def undoMove(self):
         
         if len(self.move_log) != 0:  # make sure that there is a move to undo
             move = self.move_log.pop()
+            # castling rights, en passant, Zobrist key, evaluation and halfmove clock come back from the move's
+            # undo record
+            _, self.castling_rights, self.enpassant_possible, self.zobrist_key, self.eval_score, \
+                self.halfmove_clock = self.undo_stack[len(self.move_log)]
             self.board[move.start_row][move.start_col] = move.piece_moved
             self.board[move.end_row][move.end_col] = move.piece_captured
+            if self.white_to_move:
+                self.fullmove_number -= 1
             self.white_to_move = not self.white_to_move  # swap players
             # update the king's position if needed
             if move.piece_moved == "wK":
@@ -95,13 +422,6 @@ class GameState:
                 self.board[move.end_row][move.end_col] = "--"  # leave landing square blank
                 self.board[move.start_row][move.end_col] = move.piece_captured
 
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
-
-            # undo castle rights
-            self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            self.current_castling_rights = self.castle_rights_log[
-                -1]  # set the current castle rights to the last one in the list
             # undo the castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2:  # king-side
@@ -110,49 +430,134 @@ class GameState:
                 else:  # queen-side
                     self.board[move.end_row][move.end_col - 2] = self.board[move.end_row][move.end_col + 1]
                     self.board[move.end_row][move.end_col + 1] = '--'
+            self.movePieceSquares(move, undo=True)
+            if ZOBRIST_DEBUG:
+                self.checkZobristKey()
+            if EVAL_DEBUG:
+                self.checkEvalScore()
+            if PIECE_SQUARES_DEBUG:
+                self.checkPieceSquares()
             self.checkmate = False
             self.stalemate = False
 
+    def computeZobristKey(self):
+        """
+        Compute the Zobrist key of the position from scratch.
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    key ^= ZOBRIST_PIECES[piece][row * 8 + col]
+        key ^= ZOBRIST_CASTLING[self.castling_rights]
+        if self.enpassant_possible:
+            key ^= ZOBRIST_ENPASSANT[self.enpassant_possible[1]]
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key
+
+    def checkZobristKey(self):
+        """
+        Debug check that the incrementally updated key matches a full recomputation.
+        """
+        expected = self.computeZobristKey()
+        if self.zobrist_key != expected:
+            raise RuntimeError("Zobrist key mismatch after " + str(len(self.move_log)) + " moves: " +
+                               hex(self.zobrist_key) + " != " + hex(expected))
+
+    def movePieceSquares(self, move, undo=False):
+        """
+        Update piece_squares for the squares the move touches, or put them back with undo=True.
+        """
+        own = self.piece_squares[move.piece_moved[0]]
+        start = move.start_row * 8 + move.start_col
+        end = move.end_row * 8 + move.end_col
+        if undo:
+            start, end = end, start
+        own.remove(start)
+        own.add(end)
+        if move.is_capture:
+            enemy = self.piece_squares[move.piece_captured[0]]
+            captured = move.start_row * 8 + move.end_col if move.is_enpassant_move else move.end_row * 8 + move.end_col
+            if undo:
+                enemy.add(captured)
+            else:
+                enemy.remove(captured)
+        if move.is_castle_move:
+            row = move.end_row * 8
+            if move.end_col - move.start_col == 2:  # king-side
+                rook_start, rook_end = row + 7, row + 5
+            else:  # queen-side
+                rook_start, rook_end = row, row + 3
+            if undo:
+                rook_start, rook_end = rook_end, rook_start
+            own.remove(rook_start)
+            own.add(rook_end)
+
+    def pieceCount(self):
+        return len(self.piece_squares["w"]) + len(self.piece_squares["b"])
+
+    def occupiedSquares(self):
+        """
+        Squares (row * 8 + col) of every piece on the board.
+        """
+        return self.piece_squares["w"] | self.piece_squares["b"]
+
+    def computePieceSquares(self):
+        """
+        Occupied squares of each colour, found by scanning the board.
+        """
+        piece_squares = {"w": set(), "b": set()}
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    piece_squares[piece[0]].add(row * 8 + col)
+        return piece_squares
+
+    def checkPieceSquares(self):
+        """
+        Debug check that the incrementally updated piece_squares match the board.
+        """
+        expected = self.computePieceSquares()
+        if self.piece_squares != expected:
+            raise RuntimeError("Piece squares mismatch after " + str(len(self.move_log)) + " moves: " +
+                               str(self.piece_squares) + " != " + str(expected))
+
+    def computeEvalScore(self):
+        """
+        Compute the material + piece-square score from scratch by scanning the board.
+        """
+        score = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    score += PIECE_SQUARE_SCORES[piece][row * 8 + col]
+        return score
+
+    def checkEvalScore(self):
+        """
+        Debug check that the incrementally updated eval_score matches a full recount.
+        """
+        expected = self.computeEvalScore()
+        if self.eval_score != expected:
+            raise RuntimeError("Evaluation mismatch after " + str(len(self.move_log)) + " moves: " +
+                               str(self.eval_score) + " != " + str(expected))
+
     def updateCastleRights(self, move):
         """
-        Update the castle rights given the move
-        """
-        if move.piece_captured == "wR":
-            if move.end_col == 0:  # left rook
-                self.current_castling_rights.wqs = False
-            elif move.end_col == 7:  # right rook
-                self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
-            if move.end_col == 0:  # left rook
-                self.current_castling_rights.bqs = False
-            elif move.end_col == 7:  # right rook
-                self.current_castling_rights.bks = False
-
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wqs = False
-            self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bqs = False
-            self.current_castling_rights.bks = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.bks = False
+        Update the castle rights given the move: a king or rook leaving its start square, or a rook captured there,
+        loses the matching rights.
+        """
+        self.castling_rights &= CASTLING_MASKS[move.start_row * 8 + move.start_col] & \
+            CASTLING_MASKS[move.end_row * 8 + move.end_col]
 
     def getValidMoves(self):
         """
         All moves considering checks.
         """
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                          self.current_castling_rights.wqs, self.current_castling_rights.bqs)
         # advanced algorithm
         moves = []
         self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
@@ -165,30 +570,7 @@ class GameState:
             king_col = self.black_king_location[1]
         if self.in_check:
             if len(self.checks) == 1:  # only 1 check, block the check or move the king
-                moves = self.getAllPossibleMoves()
-                # to block the check you must put a piece into one of the squares between the enemy piece and your king
-                check = self.checks[0]  # check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []  # squares that pieces can move to
-                # if knight, must capture the knight or move your king, other pieces can be blocked
-                if piece_checking[1] == "N":
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)  # check[2] and check[3] are the check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[
-                            1] == check_col:  # once you get to piece and check
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].piece_moved[1] != "K":  # move doesn't move king so it must block or capture
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
+                moves = self.getEvasionMoves(king_row, king_col)
             else:  # double check, king has to move
                 self.getKingMoves(king_row, king_col, moves)
         else:  # not in check - all moves are fine
@@ -197,6 +579,8 @@ class GameState:
                 self.getCastleMoves(self.white_king_location[0], self.white_king_location[1], moves)
             else:
                 self.getCastleMoves(self.black_king_location[0], self.black_king_location[1], moves)
+        if self.underpromotions:
+            self.addUnderpromotions(moves)
 
         if len(moves) == 0:
             if self.inCheck():
@@ -208,9 +592,184 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
-        self.current_castling_rights = temp_castle_rights
         return moves
 
+    def getValidCaptures(self):
+        """
+        Captures considering checks, for the quiescence search. In check all evasions are returned.
+        Without moves the checkmate flag is set, stalemate can't be told apart from having no captures.
+        """
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.in_check:
+            return self.getValidMoves()
+        moves = []
+        ally_color = "w" if self.white_to_move else "b"
+        for square in sorted(self.piece_squares[ally_color]):
+            row = square >> 3
+            col = square & 7
+            piece = self.board[row][col][1]
+            if piece != "K":
+                self.moveFunctions[piece](row, col, moves)
+        moves = [move for move in moves if move.is_capture]
+
+        # king captures only, without trying the quiet king moves
+        king_row, king_col = self.white_king_location if self.white_to_move else self.black_king_location
+        for row_move, col_move in ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)):
+            end_row = king_row + row_move
+            end_col = king_col + col_move
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                end_piece = self.board[end_row][end_col]
+                if end_piece != "--" and end_piece[0] != ally_color:
+                    if ally_color == "w":
+                        self.white_king_location = (end_row, end_col)
+                    else:
+                        self.black_king_location = (end_row, end_col)
+                    in_check, pins, checks = self.checkForPinsAndChecks()
+                    if not in_check:
+                        moves.append(cachedMove((king_row, king_col), (end_row, end_col), self.board))
+                    if ally_color == "w":
+                        self.white_king_location = (king_row, king_col)
+                    else:
+                        self.black_king_location = (king_row, king_col)
+        if self.underpromotions:
+            self.addUnderpromotions(moves)
+        self.checkmate = False
+        self.stalemate = False
+        return moves
+
+    def getValidQuiets(self):
+        """
+        Legal moves that don't capture. The piece generators can't skip captures, so this filters getValidMoves.
+        """
+        return [move for move in self.getValidMoves() if not move.is_capture]
+
+    def getEvasionMoves(self, king_row, king_col):
+        """
+        Moves out of a single check: king moves, captures of the checking piece and interpositions on the squares
+        between it and the king. Only pieces that reach those squares are looked at, pinned pieces never can.
+        """
+        moves = []
+        self.getKingMoves(king_row, king_col, moves)
+        board = self.board
+        check_row, check_col = self.checks[0][0], self.checks[0][1]
+        ally_color = "w" if self.white_to_move else "b"
+        pawn, knight = ally_color + "p", ally_color + "N"
+        pawn_step = -1 if self.white_to_move else 1
+        pawn_start_row = 6 if self.white_to_move else 1
+        pinned = {(pin[0], pin[1]) for pin in self.pins}
+        targets = [(check_row, check_col)] + BETWEEN_SQUARES[king_row * 8 + king_col][check_row * 8 + check_col]
+        for end_row, end_col in targets:
+            end_square = end_row * 8 + end_col
+            for row, col in KNIGHT_SQUARES[end_square]:
+                if board[row][col] == knight and (row, col) not in pinned:
+                    moves.append(cachedMove((row, col), (end_row, end_col), board))
+            for rays, sliders in ((ORTHOGONAL_RAYS, "RQ"), (DIAGONAL_RAYS, "BQ")):
+                for ray in rays[end_square]:
+                    for row, col in ray:  # the first piece on the ray is the only one that can slide here
+                        piece = board[row][col]
+                        if piece != "--":
+                            if piece[0] == ally_color and piece[1] in sliders and (row, col) not in pinned:
+                                moves.append(cachedMove((row, col), (end_row, end_col), board))
+                            break
+            row = end_row - pawn_step
+            if not 0 <= row <= 7:
+                continue
+            if end_row == check_row and end_col == check_col:  # pawns capture the checking piece
+                for col in (end_col - 1, end_col + 1):
+                    if 0 <= col <= 7 and board[row][col] == pawn and (row, col) not in pinned:
+                        moves.append(cachedMove((row, col), (end_row, end_col), board))
+            elif board[row][end_col] == pawn:  # or block with a push
+                if (row, end_col) not in pinned:
+                    moves.append(cachedMove((row, end_col), (end_row, end_col), board))
+            elif board[row][end_col] == "--" and row - pawn_step == pawn_start_row and \
+                    board[pawn_start_row][end_col] == pawn and (pawn_start_row, end_col) not in pinned:
+                moves.append(cachedMove((pawn_start_row, end_col), (end_row, end_col), board))
+        if self.enpassant_possible:
+            # en passant takes a checking pawn that just moved two squares, or blocks on the square it lands on
+            enpassant_row, enpassant_col = self.enpassant_possible
+            row = enpassant_row - pawn_step
+            if (row, enpassant_col) == (check_row, check_col) or self.enpassant_possible in targets:
+                for col in (enpassant_col - 1, enpassant_col + 1):
+                    if 0 <= col <= 7 and board[row][col] == pawn and (row, col) not in pinned:
+                        pawn_moves = []
+                        self.getPawnMoves(row, col, pawn_moves)  # handles the en-passant discovered checks
+                        moves.extend(move for move in pawn_moves if move.is_enpassant_move)
+        return moves
+
+    def isLegalMove(self, move):
+        """
+        Whether move, e.g. a hash or killer move found in another position, is legal here.
+        Only the moves of the piece on its start square are generated.
+        """
+        piece = self.board[move.start_row][move.start_col]
+        if piece != move.piece_moved or piece[0] != ("w" if self.white_to_move else "b"):
+            return False
+        if not move.is_enpassant_move and self.board[move.end_row][move.end_col] != move.piece_captured:
+            return False
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.in_check:
+            return move in self.getValidMoves()
+        moves = []
+        self.moveFunctions[piece[1]](move.start_row, move.start_col, moves)
+        if piece[1] == "K":
+            self.getCastleMoves(move.start_row, move.start_col, moves)
+        if self.underpromotions:
+            self.addUnderpromotions(moves)
+        return move in moves
+
+    def generateStagedMoves(self, first_moves=(), killers=(), capture_key=None, quiet_key=None):
+        """
+        Yield the legal moves in stages, each generated only when the moves before it are used up:
+        first_moves (hash/PV move) if legal, captures, killers if legal and quiet, then the other quiet moves.
+        In check the capture stage already holds every evasion. capture_key and quiet_key sort their stage,
+        highest first. The checkmate and stalemate flags are set once the last stage is reached.
+        """
+        yielded = set()  # moveIDs of the hash and killer moves already played
+        for move in first_moves:
+            if move is not None and move.moveID not in yielded and self.isLegalMove(move):
+                yielded.add(move.moveID)
+                yield move
+        quiets = None
+        if self.split_stages:
+            captures = self.getValidCaptures()
+        else:  # the piece generators can't skip quiet moves, split one full generation instead
+            moves = self.getValidMoves()
+            if self.in_check:
+                captures = moves
+            else:
+                captures = [move for move in moves if move.is_capture]
+                quiets = [move for move in moves if not move.is_capture]
+        in_check = self.in_check
+        if capture_key is not None:
+            captures.sort(key=capture_key, reverse=True)
+        for move in captures:
+            if move.moveID not in yielded:
+                yield move
+        if in_check:
+            return
+        for move in killers:
+            if move is not None and not move.is_capture and move.moveID not in yielded and self.isLegalMove(move):
+                yielded.add(move.moveID)
+                yield move
+        if quiets is None:
+            quiets = self.getValidQuiets()
+        if not captures and not quiets:
+            self.stalemate = True
+        if quiet_key is not None:
+            quiets.sort(key=quiet_key, reverse=True)
+        for move in quiets:
+            if move.moveID not in yielded:
+                yield move
+
+    def addUnderpromotions(self, moves):
+        """
+        Add the knight, bishop and rook promotion next to every queen promotion in moves.
+        """
+        for move in [move for move in moves if move.is_pawn_promotion]:
+            for promotion_piece in ("N", "B", "R"):
+                moves.append(cachedMove((move.start_row, move.start_col), (move.end_row, move.end_col), self.board,
+                                        promotion_piece=promotion_piece))
+
     def inCheck(self):
         """
         Determine if a current player is in check
@@ -222,14 +781,35 @@ class GameState:
 
     def squareUnderAttack(self, row, col):
         """
-        Determine if enemy can attack the square row col
+        Determine if enemy can attack the square row col.
+        Looks outward from the square with the attack tables instead of generating the enemy moves.
         """
-        self.white_to_move = not self.white_to_move  # switch to opponent's point of view
-        opponents_moves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
+        board = self.board
+        enemy_color = "b" if self.white_to_move else "w"
+        square = row * 8 + col
+        enemy_knight = enemy_color + "N"
+        for end_row, end_col in KNIGHT_SQUARES[square]:
+            if board[end_row][end_col] == enemy_knight:
+                return True
+        enemy_king = enemy_color + "K"
+        for end_row, end_col in KING_SQUARES[square]:
+            if board[end_row][end_col] == enemy_king:
                 return True
+        # pawns capture forward, so a black pawn attacks from the row above and a white pawn from the row below
+        pawn_row = row - 1 if enemy_color == "b" else row + 1
+        if 0 <= pawn_row <= 7:
+            enemy_pawn = enemy_color + "p"
+            if (col > 0 and board[pawn_row][col - 1] == enemy_pawn) or \
+                    (col < 7 and board[pawn_row][col + 1] == enemy_pawn):
+                return True
+        for rays, attackers in ((ORTHOGONAL_RAYS[square], "RQ"), (DIAGONAL_RAYS[square], "BQ")):
+            for ray in rays:
+                for end_row, end_col in ray:
+                    piece = board[end_row][end_col]
+                    if piece != "--":
+                        if piece[0] == enemy_color and piece[1] in attackers:
+                            return True
+                        break
         return False
 
     def getAllPossibleMoves(self):
@@ -237,12 +817,12 @@ class GameState:
         All moves without considering checks.
         """
         moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == "w" and self.white_to_move) or (turn == "b" and not self.white_to_move):
-                    piece = self.board[row][col][1]
-                    self.moveFunctions[piece](row, col, moves)  # calls appropriate move function based on piece type
+        # only the squares of the side to move, in board order so the move order stays the same
+        for square in sorted(self.piece_squares["w" if self.white_to_move else "b"]):
+            row = square >> 3
+            col = square & 7
+            piece = self.board[row][col][1]
+            self.moveFunctions[piece](row, col, moves)  # calls appropriate move function based on piece type
         return moves
 
     def checkForPinsAndChecks(self):
@@ -333,13 +913,13 @@ class GameState:
 
         if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
             if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
+                moves.append(cachedMove((row, col), (row + move_amount, col), self.board))
                 if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
-                    moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
+                    moves.append(cachedMove((row, col), (row + 2 * move_amount, col), self.board))
         if col - 1 >= 0:  # capture to the left
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
+                    moves.append(cachedMove((row, col), (row + move_amount, col - 1), self.board))
                 if (row + move_amount, col - 1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -361,11 +941,11 @@ class GameState:
                             elif square != "--":
                                 blocking_piece = True
                     if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
+                        moves.append(cachedMove((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
         if col + 1 <= 7:  # capture to the right
             if not piece_pinned or pin_direction == (move_amount, +1):
                 if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
+                    moves.append(cachedMove((row, col), (row + move_amount, col + 1), self.board))
                 if (row + move_amount, col + 1) == self.enpassant_possible:
                     attacking_piece = blocking_piece = False
                     if king_row == row:
@@ -387,7 +967,7 @@ class GameState:
                             elif square != "--":
                                 blocking_piece = True
                     if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
+                        moves.append(cachedMove((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
 
     def getRookMoves(self, row, col, moves):
         """
@@ -415,9 +995,9 @@ class GameState:
                             -direction[0], -direction[1]):
                         end_piece = self.board[end_row][end_col]
                         if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            moves.append(cachedMove((row, col), (end_row, end_col), self.board))
                         elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            moves.append(cachedMove((row, col), (end_row, end_col), self.board))
                             break
                         else:  # friendly piece
                             break
@@ -445,7 +1025,7 @@ class GameState:
                 if not piece_pinned:
                     end_piece = self.board[end_row][end_col]
                     if end_piece[0] != ally_color:  # so its either enemy piece or empty square
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                        moves.append(cachedMove((row, col), (end_row, end_col), self.board))
 
     def getBishopMoves(self, row, col, moves):
         """
@@ -471,9 +1051,9 @@ class GameState:
                             -direction[0], -direction[1]):
                         end_piece = self.board[end_row][end_col]
                         if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            moves.append(cachedMove((row, col), (end_row, end_col), self.board))
                         elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                            moves.append(cachedMove((row, col), (end_row, end_col), self.board))
                             break
                         else:  # friendly piece
                             break
@@ -483,9 +1063,10 @@ class GameState:
     def getQueenMoves(self, row, col, moves):
         """
         Get all the queen moves for the queen located at row col and add the moves to the list.
+        Rook moves first: they leave a queen's pin in self.pins for the bishop moves, which then remove it.
         """
-        self.getBishopMoves(row, col, moves)
         self.getRookMoves(row, col, moves)
+        self.getBishopMoves(row, col, moves)
 
     def getKingMoves(self, row, col, moves):
         """
@@ -507,7 +1088,7 @@ class GameState:
                         self.black_king_location = (end_row, end_col)
                     in_check, pins, checks = self.checkForPinsAndChecks()
                     if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+                        moves.append(cachedMove((row, col), (end_row, end_col), self.board))
                     # place king back on original location
                     if ally_color == "w":
                         self.white_king_location = (row, col)
@@ -520,30 +1101,23 @@ class GameState:
         """
         if self.squareUnderAttack(row, col):
             return  # can't castle while in check
-        if (self.white_to_move and self.current_castling_rights.wks) or (
-                not self.white_to_move and self.current_castling_rights.bks):
+        if self.castling_rights & (WHITE_KINGSIDE if self.white_to_move else BLACK_KINGSIDE):
             self.getKingsideCastleMoves(row, col, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (
-                not self.white_to_move and self.current_castling_rights.bqs):
+        if self.castling_rights & (WHITE_QUEENSIDE if self.white_to_move else BLACK_QUEENSIDE):
             self.getQueensideCastleMoves(row, col, moves)
 
     def getKingsideCastleMoves(self, row, col, moves):
         if self.board[row][col + 1] == '--' and self.board[row][col + 2] == '--':
             if not self.squareUnderAttack(row, col + 1) and not self.squareUnderAttack(row, col + 2):
-                moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
+                moves.append(cachedMove((row, col), (row, col + 2), self.board, is_castle_move=True))
 
     def getQueensideCastleMoves(self, row, col, moves):
         if self.board[row][col - 1] == '--' and self.board[row][col - 2] == '--' and self.board[row][col - 3] == '--':
             if not self.squareUnderAttack(row, col - 1) and not self.squareUnderAttack(row, col - 2):
-                moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
+                moves.append(cachedMove((row, col), (row, col - 2), self.board, is_castle_move=True))
 
 
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
+ENGINES = {"mailbox": GameState}  # GameState backends by name, ChessBitboard adds "bitboard" when imported
 
 
 class Move:
@@ -556,8 +1130,13 @@ class Move:
     files_to_cols = {"a": 0, "b": 1, "c": 2, "d": 3,
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
+    # packed 16-bit move code: start square | end square << 6 | promotion piece << 12 | en passant << 14 | castle << 15
+    promotion_pieces = "QNBR"
+    __slots__ = ("start_row", "start_col", "end_row", "end_col", "piece_moved", "piece_captured", "is_pawn_promotion",
+                 "promotion_piece", "is_enpassant_move", "is_castle_move", "is_capture", "moveID", "code")
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False,
+                 promotion_piece="Q"):
         self.start_row = start_square[0]
         self.start_col = start_square[1]
         self.end_row = end_square[0]
@@ -567,6 +1146,7 @@ class Move:
         # pawn promotion
         self.is_pawn_promotion = (self.piece_moved == "wp" and self.end_row == 0) or (
                 self.piece_moved == "bp" and self.end_row == 7)
+        self.promotion_piece = promotion_piece if self.is_pawn_promotion else None
         # en passant
         self.is_enpassant_move = is_enpassant_move
         if self.is_enpassant_move:
@@ -576,6 +1156,22 @@ class Move:
 
         self.is_capture = self.piece_captured != "--"
         self.moveID = self.start_row * 1000 + self.start_col * 100 + self.end_row * 10 + self.end_col
+        self.code = (self.start_row * 8 + self.start_col) | (self.end_row * 8 + self.end_col) << 6 | \
+            is_enpassant_move << 14 | is_castle_move << 15
+        if self.is_pawn_promotion:
+            promotion_index = self.promotion_pieces.index(promotion_piece)
+            self.moveID += promotion_index * 10000  # queen promotions keep the plain moveID
+            self.code |= promotion_index << 12
+
+    @classmethod
+    def fromCode(cls, code, board):
+        """
+        Build the Move of a packed move code on board, the position the move is played from.
+        """
+        start = code & 63
+        end = code >> 6 & 63
+        return cls((start >> 3, start & 7), (end >> 3, end & 7), board, is_enpassant_move=bool(code >> 14 & 1),
+                   is_castle_move=bool(code >> 15 & 1), promotion_piece=cls.promotion_pieces[code >> 12 & 3])
 
     def __eq__(self, other):
         """
@@ -585,9 +1181,15 @@ class Move:
             return self.moveID == other.moveID
         return False
 
+    def __hash__(self):
+        """
+        Moves that are equal have the same moveID, so moves can be used in sets and as dict keys.
+        """
+        return self.moveID
+
     def getChessNotation(self):
         if self.is_pawn_promotion:
-            return self.getRankFile(self.end_row, self.end_col) + "Q"
+            return self.getRankFile(self.end_row, self.end_col) + self.promotion_piece
         if self.is_castle_move:
             if self.end_col == 1:
                 return "0-0-0"
@@ -613,6 +1215,15 @@ class Move:
     def getRankFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
 
+    def toUCI(self):
+        """
+        Coordinate notation used by other engines and the game server, e.g. e2e4 or e7e8q.
+        """
+        text = self.getRankFile(self.start_row, self.start_col) + self.getRankFile(self.end_row, self.end_col)
+        if self.is_pawn_promotion:
+            text += self.promotion_piece.lower()
+        return text
+
     def __str__(self):
         if self.is_castle_move:
             return "0-0" if self.end_col == 6 else "0-0-0"
@@ -623,7 +1234,7 @@ class Move:
             if self.is_capture:
                 return self.cols_to_files[self.start_col] + "x" + end_square
             else:
-                return end_square + "Q" if self.is_pawn_promotion else end_square
+                return end_square + self.promotion_piece if self.is_pawn_promotion else end_square
 
         move_string = self.piece_moved[1]
         if self.is_capture:
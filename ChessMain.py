@@ -1,8 +1,7 @@
 import asyncio
 import pygame as p
-import ChessEngine, ChessAI
+import ChessEngine, ChessAI, ChessBitboard, ChessWorker, ChessTime
 import sys
-from multiprocessing import Process, Queue
 import platform
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
@@ -17,6 +16,20 @@ IMAGES = {}
 MODE_PVP = "Player vs Player"
 MODE_PVAI = "Player vs AI"
 
+# Engine backend: bitboards (ChessBitboard) or the original list-of-lists board (ChessEngine)
+USE_BITBOARD_ENGINE = True
+# The AI searches on the human's time in Player vs AI games
+PONDER = True
+# Time control: seconds on each clock at the start and added after every move
+CLOCK_TIME = 600
+CLOCK_INCREMENT = 0
+
+def newGameState():
+    """Create a game state with the selected engine backend."""
+    if USE_BITBOARD_ENGINE:
+        return ChessBitboard.BitboardGameState()
+    return ChessEngine.GameState()
+
 def loadImages():
     """Load piece, background, and instructions images."""
     pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
@@ -320,11 +333,12 @@ async def main():
     game_over = False
     ai_thinking = False
     move_undone = False
-    move_finder_process = None
+    engine_worker = ChessWorker.EngineWorker(ChessBitboard.BitboardGameState if USE_BITBOARD_ENGINE
+                                             else ChessEngine.GameState)  # started by the first AI move
     player_one = True
     player_two = False
-    white_time = 600  # 10 minutes in seconds
-    black_time = 600
+    white_time = CLOCK_TIME
+    black_time = CLOCK_TIME
     last_time_update = p.time.get_ticks()
     end_game_message = ""
 
@@ -346,12 +360,12 @@ async def main():
                         in_instructions = True
                     elif start_rect.collidepoint(pos):
                         in_menu = False
-                        game_state = ChessEngine.GameState()
+                        game_state = newGameState()
                         valid_moves = game_state.getValidMoves()
                         player_one = True
                         player_two = selected_mode == MODE_PVP
-                        white_time = 600
-                        black_time = 600
+                        white_time = CLOCK_TIME
+                        black_time = CLOCK_TIME
                         last_time_update = p.time.get_ticks()
             p.display.flip()
             clock.tick(MAX_FPS)
@@ -392,7 +406,7 @@ async def main():
                     elif menu_rect.collidepoint(pos):
                         in_pause = False
                         in_menu = True
-                        game_state = ChessEngine.GameState()
+                        game_state = newGameState()
                         valid_moves = game_state.getValidMoves()
                         square_selected = ""
                         player_clicks = []
@@ -400,13 +414,13 @@ async def main():
                         animate = False
                         game_over = False
                         end_game_message = ""
-                        white_time = 600
-                        black_time = 600
+                        white_time = CLOCK_TIME
+                        black_time = CLOCK_TIME
                         if ai_thinking:
-                            move_finder_process.terminate()
+                            engine_worker.cancel()
                             ai_thinking = False
                     elif restart_rect.collidepoint(pos):
-                        game_state = ChessEngine.GameState()
+                        game_state = newGameState()
                         valid_moves = game_state.getValidMoves()
                         square_selected = ""
                         player_clicks = []
@@ -414,10 +428,10 @@ async def main():
                         animate = False
                         game_over = False
                         end_game_message = ""
-                        white_time = 600
-                        black_time = 600
+                        white_time = CLOCK_TIME
+                        black_time = CLOCK_TIME
                         if ai_thinking:
-                            move_finder_process.terminate()
+                            engine_worker.cancel()
                             ai_thinking = False
                         in_pause = False
                 elif e.type == p.KEYDOWN:
@@ -431,8 +445,8 @@ async def main():
 
         human_turn = (game_state.white_to_move and player_one) or (not game_state.white_to_move and player_two)
 
-        # Update timer
-        if not in_menu and not in_instructions and human_turn and not game_over and not in_pause:
+        # Update timer, the AI's thinking time runs on its clock too
+        if not in_menu and not in_instructions and not game_over and not in_pause:
             current_time = p.time.get_ticks()
             elapsed = (current_time - last_time_update) / 1000
             if game_state.white_to_move:
@@ -446,6 +460,9 @@ async def main():
                     game_over = True
                     end_game_message = "White wins by time"
             last_time_update = current_time
+            if game_over and ai_thinking:
+                engine_worker.cancel()
+                ai_thinking = False
 
         for e in p.event.get():
             if e.type == p.QUIT:
@@ -469,6 +486,10 @@ async def main():
                         for i in range(len(valid_moves)):
                             if move == valid_moves[i]:
                                 game_state.makeMove(valid_moves[i])
+                                if game_state.white_to_move:
+                                    black_time += CLOCK_INCREMENT
+                                else:
+                                    white_time += CLOCK_INCREMENT
                                 move_made = True
                                 animate = True
                                 square_selected = ""
@@ -483,24 +504,32 @@ async def main():
                     game_over = False
                     end_game_message = ""
                     if ai_thinking:
-                        move_finder_process.terminate()
+                        engine_worker.cancel()
                         ai_thinking = False
                     move_undone = True
                 elif e.key == p.K_p:
                     in_pause = True
+                    if ai_thinking:  # the search starts again with the remaining clock on resume
+                        engine_worker.cancel()
+                        ai_thinking = False
 
         # AI move
         if not game_over and not human_turn and not move_undone and not in_pause:
             if not ai_thinking:
                 ai_thinking = True
-                return_queue = Queue()
-                move_finder_process = Process(target=ChessAI.findBestMove, args=(game_state, valid_moves, return_queue))
-                move_finder_process.start()
-            if not move_finder_process.is_alive():
-                ai_move = return_queue.get()
+                soft_limit, hard_limit = ChessTime.allocateTime(
+                    white_time if game_state.white_to_move else black_time, CLOCK_INCREMENT,
+                    len(game_state.move_log) // 2)
+                engine_worker.search(game_state, valid_moves, soft_limit, hard_limit)
+            if engine_worker.poll():
+                ai_move = engine_worker.best_move
                 if ai_move is None:
                     ai_move = ChessAI.findRandomMove(valid_moves)
                 game_state.makeMove(ai_move)
+                if game_state.white_to_move:
+                    black_time += CLOCK_INCREMENT
+                else:
+                    white_time += CLOCK_INCREMENT
                 move_made = True
                 animate = True
                 ai_thinking = False
@@ -513,6 +542,9 @@ async def main():
             animate = False
             move_undone = False
 
+        if PONDER and not player_two and human_turn and not game_over and not in_pause:
+            engine_worker.ponder(game_state)
+
         drawGameState(screen, game_state, valid_moves, square_selected)
         if not game_over:
             drawMoveLog(screen, game_state, move_log_font)
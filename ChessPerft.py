@@ -0,0 +1,176 @@
+"""
+Perft: count the leaf nodes of the legal move tree to a fixed depth.
+Used to verify getValidMoves against published node counts and to benchmark the move generators.
+
+python ChessPerft.py                      run every reference position and report mismatches
+python ChessPerft.py -p kiwipete -d 3 --divide
+python ChessPerft.py --fen "<FEN>" -d 5 --workers 4 --engine mailbox
+"""
+import argparse
+import sys
+import time
+from multiprocessing import Pool
+
+import ChessEngine
+import ChessBitboard
+
+assert ChessEngine.ENGINES["bitboard"] is ChessBitboard.BitboardGameState  # registered by importing ChessBitboard
+
+# name: (FEN, {depth: published node count})
+POSITIONS = {
+    "start": (ChessEngine.START_FEN,
+              {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609}),
+    "kiwipete": ("r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+                 {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    "position3": ("8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+                  {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624}),
+    "position4": ("r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+                  {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    "position4-mirrored": ("r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+                           {1: 6, 2: 264, 3: 9467, 4: 422333}),
+    "position5": ("rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+                  {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    "position6": ("r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+                  {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+    # en-passant edge cases
+    "ep-illegal-pin": ("3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1", {6: 1134888}),
+    "ep-gives-check": ("8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1", {6: 1440467}),
+    "ep-no-capture": ("8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1", {6: 1015133}),
+    # castling edge cases
+    "castle-gives-check": ("5k2/8/8/8/8/8/8/4K2R w K - 0 1", {6: 661072}),
+    "long-castle-gives-check": ("3k4/8/8/8/8/8/8/R3K3 w Q - 0 1", {6: 803711}),
+    "castle-rights": ("r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1", {4: 1274206}),
+    "castle-prevented": ("r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1", {4: 1720476}),
+    # promotion edge cases
+    "promote-out-of-check": ("2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1", {6: 3821001}),
+    "promote-gives-check": ("4k3/1P6/8/8/8/8/K7/8 w - - 0 1", {6: 217342}),
+    "underpromote-gives-check": ("8/P1k5/K7/8/8/8/8/8 w - - 0 1", {6: 92683}),
+    # checks and mates
+    "discovered-check": ("8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1", {5: 1004658}),
+    "self-stalemate": ("K1k5/8/P7/8/8/8/8/8 w - - 0 1", {6: 2217}),
+    "stalemate-checkmate": ("8/k1P5/8/1K6/8/8/8/8 w - - 0 1", {7: 567584}),
+    "double-check": ("8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1", {4: 23527}),
+}
+
+
+def newPosition(engine, fen):
+    """
+    Game state of the engine backend set up from fen, generating every promotion piece like the published counts.
+    """
+    game_state = ChessEngine.ENGINES[engine]()
+    game_state.loadFEN(fen)
+    game_state.underpromotions = True
+    return game_state
+
+
+def perft(game_state, depth):
+    """
+    Number of leaf nodes of the legal move tree depth plies below the current position.
+    """
+    if depth == 0:
+        return 1
+    moves = game_state.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game_state.makeMove(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undoMove()
+    return nodes
+
+
+def _divideWorker(args):
+    engine, fen, move_index, depth = args
+    game_state = newPosition(engine, fen)
+    move = game_state.getValidMoves()[move_index]
+    game_state.makeMove(move)
+    return move.toUCI(), perft(game_state, depth - 1)
+
+
+def divide(engine, fen, depth, workers=1):
+    """
+    Perft of every root move as a list of (move, nodes). With workers > 1 the root moves are split over a process pool.
+    """
+    if depth < 1:
+        raise ValueError("divide needs depth >= 1")
+    root_moves = newPosition(engine, fen).getValidMoves()
+    jobs = [(engine, fen, move_index, depth) for move_index in range(len(root_moves))]
+    if workers > 1:
+        with Pool(workers) as pool:
+            return pool.map(_divideWorker, jobs)
+    return [_divideWorker(job) for job in jobs]
+
+
+def runPerft(engine, fen, depth, workers=1):
+    """
+    Return (nodes, seconds) of perft(depth) from fen.
+    """
+    start = time.perf_counter()
+    if workers > 1 and depth > 1:
+        nodes = sum(count for _, count in divide(engine, fen, depth, workers))
+    else:
+        nodes = perft(newPosition(engine, fen), depth)
+    return nodes, time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft verification and benchmark of the move generators.")
+    parser.add_argument("-p", "--position", action="append", choices=sorted(POSITIONS),
+                        help="reference position to run (repeatable), default all")
+    parser.add_argument("--fen", help="run a custom FEN instead of the reference positions")
+    parser.add_argument("-d", "--depth", type=int,
+                        help="depth to search, default the deepest known count up to --max-nodes")
+    parser.add_argument("--max-nodes", type=int, default=2000000,
+                        help="without --depth, use the deepest known count up to this many nodes (default 2000000)")
+    parser.add_argument("--divide", action="store_true", help="print the node count of every root move")
+    parser.add_argument("-w", "--workers", type=int, default=1, help="processes to split the root moves over")
+    parser.add_argument("-e", "--engine", choices=sorted(ChessEngine.ENGINES), default="bitboard")
+    args = parser.parse_args(argv)
+
+    if args.fen:
+        if args.depth is None:
+            parser.error("--fen needs --depth")
+        runs = [("fen", args.fen, args.depth, None)]
+    else:
+        runs = []
+        for name in args.position or POSITIONS:
+            fen, counts = POSITIONS[name]
+            if args.depth is not None:
+                depth = args.depth
+            else:
+                small = [depth for depth, nodes in counts.items() if nodes <= args.max_nodes]
+                depth = max(small) if small else min(counts)
+            runs.append((name, fen, depth, counts.get(depth)))
+
+    mismatches = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, depth, expected in runs:
+        if args.divide:
+            start = time.perf_counter()
+            results = divide(args.engine, fen, depth, args.workers)
+            seconds = time.perf_counter() - start
+            for move, count in sorted(results):
+                print("  " + move + ": " + str(count))
+            nodes = sum(count for _, count in results)
+        else:
+            nodes, seconds = runPerft(args.engine, fen, depth, args.workers)
+        total_nodes += nodes
+        total_time += seconds
+        if expected is None:
+            status = ""
+        elif nodes == expected:
+            status = "ok"
+        else:
+            status = "MISMATCH expected " + str(expected)
+            mismatches += 1
+        print("%-26s depth %d  %10d nodes  %7.2fs  %9d nodes/s  %s" %
+              (name, depth, nodes, seconds, nodes / seconds if seconds > 0 else 0, status))
+    print("total %d nodes in %.2fs, %d nodes/s, %d mismatches" %
+          (total_nodes, total_time, total_nodes / total_time if total_time > 0 else 0, mismatches))
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""
+Fixed-size binary encoding of a position, for sending to other processes and for position stores on disk.
+A record is POSITION_SIZE bytes: the 64 squares as 4-bit piece codes (two squares a byte, row * 8 + col order,
+even square in the low nibble), a flags byte (bit 0 white to move, bits 1-4 the castling rights mask), the
+en-passant column (EMPTY_ENPASSANT if none) and the halfmove clock and fullmove number. pack/unpack work on any
+writable buffer at an offset, so records can live in a bytearray, an mmap or a multiprocessing.shared_memory block.
+The move history doesn't travel with the position.
+"""
+import struct
+
+import ChessEngine
+
+POSITION_RECORD = struct.Struct("<32sBBHH")  # piece nibbles, flags, en-passant column, halfmove clock, fullmove number
+POSITION_SIZE = POSITION_RECORD.size
+EMPTY_ENPASSANT = 0xFF
+PIECE_CODES = {"--": 0, "wp": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+               "bp": 9, "bN": 10, "bB": 11, "bR": 12, "bQ": 13, "bK": 14}  # bit 3 is the colour
+CODE_PIECES = {code: piece for piece, code in PIECE_CODES.items()}
+# every byte value as the two pieces it holds, invalid nibbles decode to None
+BYTE_PIECES = [(CODE_PIECES.get(value & 15), CODE_PIECES.get(value >> 4)) for value in range(256)]
+
+
+def packPosition(game_state, buffer, offset=0):
+    """
+    Write the position of game_state as a record into buffer at offset.
+    """
+    board = game_state.board
+    squares = bytes(PIECE_CODES[board[row][col]] | PIECE_CODES[board[row][col + 1]] << 4
+                    for row in range(8) for col in range(0, 8, 2))
+    flags = game_state.white_to_move | game_state.castling_rights << 1
+    enpassant = game_state.enpassant_possible
+    POSITION_RECORD.pack_into(buffer, offset, squares, flags, enpassant[1] if enpassant else EMPTY_ENPASSANT,
+                              game_state.halfmove_clock, game_state.fullmove_number)
+
+
+def encodePosition(game_state):
+    """
+    The position of game_state as a bytes record.
+    """
+    buffer = bytearray(POSITION_SIZE)
+    packPosition(game_state, buffer)
+    return bytes(buffer)
+
+
+def unpackPosition(buffer, offset=0):
+    """
+    Read the record at offset as (board, white_to_move, castling rights, en-passant square, halfmove clock,
+    fullmove number) as parseFEN returns them. ValueError if the record holds a bad piece code.
+    """
+    squares, flags, enpassant_col, halfmove_clock, fullmove_number = POSITION_RECORD.unpack_from(buffer, offset)
+    board = []
+    for row in range(8):
+        pieces = []
+        for value in squares[row * 4:row * 4 + 4]:
+            pieces.extend(BYTE_PIECES[value])
+        board.append(pieces)
+        if None in pieces:
+            raise ValueError("bad piece code in position record")
+    white_to_move = bool(flags & 1)
+    enpassant = () if enpassant_col == EMPTY_ENPASSANT else (2 if white_to_move else 5, enpassant_col)
+    return board, white_to_move, flags >> 1 & ChessEngine.ALL_CASTLING, enpassant, halfmove_clock, fullmove_number
+
+
+def decodePosition(buffer, game_state=None, offset=0):
+    """
+    Set up game_state (a new ChessEngine.GameState if None) with the record at offset and return it.
+    """
+    if game_state is None:
+        game_state = ChessEngine.GameState()
+    game_state.setPosition(*unpackPosition(buffer, offset))
+    return game_state
+
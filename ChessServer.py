@@ -0,0 +1,331 @@
+"""
+Headless game server: many games at once over a local socket, the engine moves come from a bounded process pool.
+The protocol is one JSON object per line each way. Every request has an "op" and an optional "id" that is copied
+into its answer, answers carry "ok" and "error" when ok is false. Moves are in coordinate notation (e2e4, e7e8q).
+
+    {"op": "new", "fen": "<FEN, optional>"}        -> {"ok": true, "game": 1, "status": "playing"}
+    {"op": "move", "game": 1, "move": "e2e4"}       -> {"ok": true, "status": "playing"}
+    {"op": "go", "game": 1, "time": 0.1}            -> {"ok": true, "move": "e7e5", "status": "playing", "seconds": 0.1}
+    {"op": "legal", "game": 1}                      -> {"ok": true, "moves": ["a7a6", ...]}
+    {"op": "close", "game": 1}                      -> {"ok": true}
+
+"go" plays the engine's move in the game, without "time" the engine searches to ChessAI.DEPTH. Status is
+"playing", "checkmate" or "stalemate". Requests of one connection are answered as they finish, not in order.
+A game belongs to the connection that made it and is closed when that connection closes.
+
+python ChessServer.py serve --port 8765 --workers 4
+python ChessServer.py load --port 8765 --games 200 --plies 20 --time 0.05
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import queue
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import ChessAI
+import ChessBitboard
+import ChessEngine
+import ChessPosition
+
+assert ChessEngine.ENGINES["bitboard"] is ChessBitboard.BitboardGameState  # registered by importing ChessBitboard
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_WORKERS = 2
+DEFAULT_ENGINE = "bitboard"  # key of ChessEngine.ENGINES
+
+worker_game_states = {}  # engine name: GameState reused by the searches of a pool process
+
+
+def _initEngineWorker():
+    ChessAI.SEARCH_WORKERS = 1  # pool processes can't start their own pools
+
+
+def _searchPosition(engine, record, time_budget):
+    """
+    Search a ChessPosition record in a pool process and return the code of the best move, None without one.
+    """
+    game_state = worker_game_states.get(engine)
+    if game_state is None:
+        game_state = worker_game_states[engine] = ChessEngine.ENGINES[engine]()
+    ChessPosition.decodePosition(record, game_state)
+    return_queue = queue.Queue()
+    ChessAI.findBestMove(game_state, game_state.getValidMoves(), return_queue, time_budget)
+    best_move = return_queue.get()
+    return None if best_move is None else best_move.code
+
+
+class GameSession:
+    """
+    One hosted game: its GameState, the legal moves of the current position and whether the engine is searching it.
+    """
+
+    def __init__(self, game_state):
+        self.game_state = game_state
+        self.valid_moves = game_state.getValidMoves()
+        self.searching = False
+
+    @property
+    def status(self):
+        if self.game_state.checkmate:
+            return "checkmate"
+        if self.game_state.stalemate:
+            return "stalemate"
+        return "playing"
+
+    def play(self, move):
+        self.game_state.makeMove(move)
+        self.valid_moves = self.game_state.getValidMoves()
+
+
+class GameServer:
+    """
+    Holds the game sessions of all connections and the pool the engine searches run in.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, engine=DEFAULT_ENGINE):
+        if engine not in ChessEngine.ENGINES:
+            raise ValueError("engine must be one of " + ", ".join(sorted(ChessEngine.ENGINES)))
+        self.engine = engine
+        self.pool = ProcessPoolExecutor(workers, initializer=_initEngineWorker)
+        self.sessions = {}
+        self.game_ids = itertools.count(1)
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        """
+        Accept connections on a TCP port, or on the Unix socket path if given, until cancelled.
+        """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handleConnection, path)
+        else:
+            server = await asyncio.start_server(self.handleConnection, host, port)
+        async with server:
+            await server.serve_forever()
+
+    async def handleConnection(self, reader, writer):
+        tasks = set()
+        game_ids = set()  # games this connection made and hasn't closed
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.answer(line, writer, game_ids))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except ConnectionError:
+            pass
+        finally:
+            for game_id in game_ids:
+                del self.sessions[game_id]
+            writer.close()
+
+    async def answer(self, line, writer, game_ids):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+            request_id = request.get("id")
+            answer = await self.handleRequest(request, game_ids)
+            answer["ok"] = True
+        except Exception as error:  # a failed request, including a crashed pool process, mustn't drop the connection
+            answer = {"ok": False, "error": str(error) or type(error).__name__}
+        if request_id is not None:
+            answer["id"] = request_id
+        writer.write(json.dumps(answer).encode() + b"\n")
+        await writer.drain()
+
+    def getSession(self, request, game_ids):
+        session = self.sessions.get(request.get("game"))
+        if session is None:
+            raise ValueError("unknown game " + repr(request.get("game")))
+        if request["game"] not in game_ids:
+            raise ValueError("game " + repr(request["game"]) + " belongs to another connection")
+        if session.searching:
+            raise ValueError("the engine is searching this game")
+        return session
+
+    async def handleRequest(self, request, game_ids):
+        """
+        Carry out a request of the connection that made game_ids and return the fields of its answer.
+        """
+        op = request.get("op")
+        if op == "new":
+            game_state = ChessEngine.ENGINES[self.engine]()
+            if "fen" in request:
+                game_state.loadFEN(request["fen"])
+            game_id = next(self.game_ids)
+            session = self.sessions[game_id] = GameSession(game_state)
+            game_ids.add(game_id)
+            return {"game": game_id, "status": session.status}
+        if op == "move":
+            session = self.getSession(request, game_ids)
+            for move in session.valid_moves:
+                if move.toUCI() == request.get("move"):
+                    session.play(move)
+                    return {"status": session.status}
+            raise ValueError("illegal move " + repr(request.get("move")))
+        if op == "go":
+            session = self.getSession(request, game_ids)
+            if not session.valid_moves:
+                raise ValueError("the game is over")
+            start = time.perf_counter()
+            session.searching = True
+            try:
+                code = await asyncio.get_running_loop().run_in_executor(
+                    self.pool, _searchPosition, self.engine, ChessPosition.encodePosition(session.game_state),
+                    request.get("time"))
+            finally:
+                session.searching = False
+            move = next((move for move in session.valid_moves if move.code == code), None)
+            if move is None:
+                raise ValueError("the engine found no move")
+            session.play(move)
+            return {"move": move.toUCI(), "status": session.status,
+                    "seconds": round(time.perf_counter() - start, 4)}
+        if op == "legal":
+            return {"moves": [move.toUCI() for move in self.getSession(request, game_ids).valid_moves]}
+        if op == "close":
+            self.getSession(request, game_ids)
+            del self.sessions[request["game"]]
+            game_ids.discard(request["game"])
+            return {}
+        raise ValueError("unknown op " + repr(op))
+
+
+class ServerClient:
+    """
+    One connection to a GameServer. request() can be awaited by many tasks at once, answers are matched by id.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.request_ids = itertools.count(1)
+        self.pending = {}
+        self.reader_task = asyncio.create_task(self.readAnswers())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        if path is not None:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def readAnswers(self):
+        while True:
+            line = await self.reader.readline()
+            if not line:
+                break
+            answer = json.loads(line)
+            future = self.pending.pop(answer.get("id"), None)
+            if future is not None:
+                future.set_result(answer)
+        for future in self.pending.values():
+            future.set_exception(ConnectionError("server closed the connection"))
+
+    async def request(self, op, **fields):
+        """
+        Send a request and return its answer, ValueError with the server's message if ok is false.
+        """
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        self.writer.write(json.dumps(dict(fields, op=op, id=request_id)).encode() + b"\n")
+        await self.writer.drain()
+        answer = await future
+        if not answer["ok"]:
+            raise ValueError(answer["error"])
+        return answer
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+        self.reader_task.cancel()
+
+
+async def _playGame(client, plies, time_budget, latencies):
+    game = (await client.request("new"))["game"]
+    moves = 0
+    while moves < plies:
+        start = time.perf_counter()
+        answer = await client.request("go", game=game, time=time_budget)
+        latencies.append(time.perf_counter() - start)
+        moves += 1
+        if answer["status"] != "playing":
+            break
+    await client.request("close", game=game)
+    return moves
+
+
+async def runLoadTest(host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, games=100, plies=20, time_budget=0.05,
+                      connections=4):
+    """
+    Play games engine against engine on a running server, plies moves at most each, all at once over a few
+    connections. Prints and returns {"games", "moves", "seconds", "moves_per_second", "latency": {...}},
+    latencies in seconds from sending "go" to its answer.
+    """
+    clients = [await ServerClient.connect(host, port, path) for _ in range(connections)]
+    latencies = []
+    start = time.perf_counter()
+    try:
+        played = await asyncio.gather(*(_playGame(clients[game % connections], plies, time_budget, latencies)
+                                        for game in range(games)))
+    finally:
+        for client in clients:
+            await client.close()
+    seconds = time.perf_counter() - start
+    latencies.sort()
+    result = {"games": games, "moves": sum(played), "seconds": seconds,
+              "moves_per_second": sum(played) / seconds,
+              "latency": {"mean": statistics.mean(latencies), "p50": latencies[len(latencies) // 2],
+                          "p95": latencies[int(len(latencies) * 0.95)], "max": latencies[-1]}}
+    latency = result["latency"]
+    print("%d games, %d moves in %.2fs: %.1f moves/s, latency mean %.3fs p50 %.3fs p95 %.3fs max %.3fs" % (
+        games, result["moves"], seconds, result["moves_per_second"], latency["mean"], latency["p50"],
+        latency["p95"], latency["max"]))
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless game server and its load generator.")
+    parser.add_argument("command", choices=("serve", "load"))
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix", help="Unix socket path instead of TCP")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS, help="engine processes (serve)")
+    parser.add_argument("-e", "--engine", choices=sorted(ChessEngine.ENGINES), default=DEFAULT_ENGINE,
+                        help="GameState backend of the games (serve)")
+    parser.add_argument("--games", type=int, default=100, help="games played at once (load)")
+    parser.add_argument("--plies", type=int, default=20, help="moves per game at most (load)")
+    parser.add_argument("--time", type=float, default=0.05, help="engine seconds per move, 0 for ChessAI.DEPTH (load)")
+    parser.add_argument("--connections", type=int, default=4, help="connections the games are spread over (load)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        server = GameServer(args.workers, args.engine)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+    else:
+        asyncio.run(runLoadTest(args.host, args.port, args.unix, args.games, args.plies, args.time or None,
+                                args.connections))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
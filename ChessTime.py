@@ -0,0 +1,39 @@
+"""
+Time management: how long the AI may think on a move, given its clock.
+allocateTime() splits the remaining time over the moves expected to be left and adds most of the increment. That
+gives a soft limit, the time to aim for, and a hard limit where the search is stopped even in the middle of an
+iteration. startNextIteration() lets iterative deepening stop early while the best move stays the same and go on
+longer while it keeps changing.
+"""
+MOVE_OVERHEAD = 0.1  # seconds kept back for the pipe to the AI process, the animation and the UI loop
+EXPECTED_GAME_MOVES = 50  # moves left are estimated as this minus the moves played...
+MIN_MOVES_LEFT = 15  # ...but never fewer
+INCREMENT_SHARE = 0.8  # part of the increment spent on the move it is added for
+HARD_LIMIT_FACTOR = 4  # the hard limit is at most this many soft limits...
+MAX_CLOCK_SHARE = 0.3  # ...and at most this share of the remaining time
+MIN_TIME = 0.02  # depth 1 always finishes, so there is a move even with nothing left
+# soft limit scale by the iterations the best move has stayed the same: longer while it changes, shorter once settled
+STABILITY_FACTORS = (1.5, 1.1, 0.9, 0.7, 0.5)
+
+
+def allocateTime(remaining_time, increment=0.0, moves_played=0, moves_to_go=None):
+    """
+    Return (soft, hard) seconds for the next move. moves_played counts the side's own moves, moves_to_go is the
+    number of moves until the next time control, None for sudden death.
+    """
+    available = max(0.0, remaining_time - MOVE_OVERHEAD)
+    moves_left = moves_to_go or max(MIN_MOVES_LEFT, EXPECTED_GAME_MOVES - moves_played)
+    soft = min(available, available / moves_left + increment * INCREMENT_SHARE)
+    hard = min(available, max(soft, min(soft * HARD_LIMIT_FACTOR, available * MAX_CLOCK_SHARE)))
+    return max(MIN_TIME, soft), max(MIN_TIME, hard)
+
+
+def startNextIteration(elapsed, soft_limit, stable_iterations=None):
+    """
+    True if one more iteration is worth starting after elapsed seconds. An iteration takes a few times the one
+    before, so none is started past half the soft limit. With stable_iterations (completed iterations the best
+    move has stayed the same) the soft limit is first scaled by STABILITY_FACTORS.
+    """
+    if stable_iterations is not None:
+        soft_limit *= STABILITY_FACTORS[min(stable_iterations, len(STABILITY_FACTORS) - 1)]
+    return elapsed <= soft_limit / 2
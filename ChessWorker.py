@@ -0,0 +1,188 @@
+"""
+Long-lived AI process.
+The UI sends the position as a fixed-size ChessPosition record and a search request over a pipe, so a message
+doesn't grow with the game. The worker sets its own GameState up from the record, the transposition table, move
+ordering and move cache stay warm between moves. This module doesn't import pygame, so spawn-start platforms don't load it in the worker.
+
+Cancelling: a search polls a shared counter holding the last cancelled request id, so it stops within
+ChessAI.TIME_CHECK_NODES nodes, answers with the best move of its last completed iteration and the process stays
+up for the next search. With ChessAI.SEARCH_WORKERS > 1 the search passes the cancel on to its pool processes.
+
+Pondering: while the human thinks the worker searches the position after the reply its last principal variation
+expects (or the human's own position when there is no guess) until the next message arrives. When the human plays
+the expected move, the pondered time counts towards the search, otherwise the search starts with the warmed table.
+"""
+import atexit
+import queue
+import time
+from multiprocessing import Pipe, Process, Value
+
+import ChessEngine
+import ChessAI
+import ChessPosition
+
+
+def _ponder(connection, game_state, expected_reply):
+    """
+    Search until a message arrives, after expected_reply if it is legal here. Return (zobrist key of the pondered
+    position, best move found, its score, completed depth, seconds spent), or None when the human's own position
+    was pondered.
+    """
+    valid_moves = game_state.getValidMoves()
+    if expected_reply is not None and expected_reply in valid_moves:
+        game_state.makeMove(expected_reply)
+        valid_moves = game_state.getValidMoves()
+    else:
+        expected_reply = None
+    if not valid_moves:
+        if expected_reply is not None:
+            game_state.undoMove()
+        return None
+    start = time.perf_counter()
+    return_queue = queue.Queue()
+    ChessAI.findBestMove(game_state, valid_moves, return_queue, float("inf"), interrupt=connection.poll)
+    if expected_reply is None:
+        return None
+    key = game_state.zobrist_key
+    game_state.undoMove()
+    depth = ChessAI.search_depth - 1 if ChessAI.search_stopped else ChessAI.search_depth
+    return key, return_queue.get(), ChessAI.search_score, depth, time.perf_counter() - start
+
+
+def _workerLoop(connection, game_state_class, cancelled_request):
+    game_state = game_state_class()
+    expected_reply = None  # second move of the last principal variation, the human's expected answer
+    pondered = None  # (zobrist key, best move, score, depth, seconds) of the last ponder search
+    while True:
+        message = connection.recv()
+        if message[0] == "quit":
+            ChessAI.closeSearchPool()  # a child process doesn't run the atexit handlers
+            break
+        elif message[0] == "position":
+            ChessPosition.decodePosition(message[1], game_state)
+        elif message[0] == "ponder":
+            ChessPosition.decodePosition(message[1], game_state)
+            pondered = _ponder(connection, game_state, expected_reply)
+        elif message[0] == "go":
+            _, request_id, time_budget, hard_limit = message
+            best_move = None
+            if pondered is not None and pondered[0] == game_state.zobrist_key:
+                # ponder hit: answer at once if the ponder search went far enough, else search the time that is left
+                _, best_move, score, depth, seconds = pondered
+                if time_budget is None and depth < ChessAI.DEPTH:
+                    best_move = None
+                elif time_budget is not None and seconds < time_budget:
+                    best_move = None
+                    time_budget -= seconds
+                    if hard_limit is not None:
+                        hard_limit -= seconds
+            pondered = None
+            if best_move is None:
+                return_queue = queue.Queue()
+                ChessAI.findBestMove(game_state, game_state.getValidMoves(), return_queue, time_budget,
+                                     interrupt=lambda: cancelled_request.value >= request_id, hard_limit=hard_limit)
+                best_move = return_queue.get()
+                score = ChessAI.search_score
+            line = ChessAI.principal_variation
+            expected_reply = line[1] if len(line) > 1 and line[0] == best_move else None
+            connection.send(("bestmove", request_id, None if best_move is None else best_move.code, score))
+    connection.close()
+
+
+class EngineWorker:
+    """
+    Handle on the AI process. search() returns at once, poll() tells when best_move is ready, cancel() drops it.
+    """
+
+    def __init__(self, game_state_class=ChessEngine.GameState):
+        self.game_state_class = game_state_class
+        self.process = None
+        self.connection = None
+        self.request_id = 0
+        self.busy = False
+        self.valid_moves = []
+        self.best_move = None
+        self.best_score = None  # score of best_move for the side to move, None when it wasn't searched
+        self.cancelled_request = Value("i", 0, lock=False)  # searches with a request id up to this one stop
+        self.ponder_position = None  # position record the worker was last asked to ponder
+
+    def start(self):
+        self.connection, worker_connection = Pipe()
+        # not a daemon, so it can start the pool of ChessAI.findBestMoveParallel, close() runs at exit instead
+        self.process = Process(target=_workerLoop, args=(worker_connection, self.game_state_class,
+                                                         self.cancelled_request))
+        self.process.start()
+        worker_connection.close()
+        atexit.register(self.close)
+        self.busy = False
+
+    def search(self, game_state, valid_moves, time_budget=None, hard_limit=None):
+        """
+        Start searching the position of game_state, only its position record is sent to the worker.
+        time_budget and hard_limit are passed on to ChessAI.findBestMove.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.request_id += 1
+        self.valid_moves = valid_moves
+        self.best_move = None
+        self.best_score = None
+        self.connection.send(("position", ChessPosition.encodePosition(game_state)))
+        self.connection.send(("go", self.request_id, time_budget, hard_limit))
+        self.busy = True
+        self.ponder_position = None
+
+    def ponder(self, game_state):
+        """
+        Let the idle worker search on the opponent's time, until the next search() or ponder() of another position.
+        """
+        position = ChessPosition.encodePosition(game_state)
+        if self.busy or position == self.ponder_position:
+            return
+        if self.process is None or not self.process.is_alive():
+            self.start()
+        self.connection.send(("ponder", position))
+        self.ponder_position = position
+
+    def poll(self):
+        """
+        True once the current search has finished, best_move is then set (None if no move was found or the worker
+        died, the next search starts a new one).
+        """
+        while self.busy and self.connection.poll():
+            try:
+                _, request_id, code, score = self.connection.recv()
+            except EOFError:  # the worker died mid-search
+                self.busy = False
+                break
+            if request_id != self.request_id:
+                continue  # answer of a search that was cancelled
+            self.busy = False
+            self.best_score = score
+            for move in self.valid_moves:
+                if move.code == code:
+                    self.best_move = move
+        return not self.busy
+
+    def cancel(self):
+        """
+        Drop the running search. The worker stops it and is ready for the next one, its answer is ignored.
+        """
+        if self.busy:
+            self.cancelled_request.value = self.request_id
+            self.busy = False
+
+    def close(self):
+        if self.process is not None:
+            self.cancelled_request.value = self.request_id
+            try:
+                if self.process.is_alive():
+                    self.connection.send(("quit",))
+            except (BrokenPipeError, EOFError):
+                pass  # the worker died after the check
+            finally:
+                self.process.join()
+                self.connection.close()
+                self.process = None
+                self.busy = False
+                atexit.unregister(self.close)